@@ -0,0 +1,71 @@
+"""
+Compares startup cost of the old `.autocomplete_data.json` file against the lazy `completion_cache` format.
+
+Run with `python -m benchmarks.bench_completion_cache [parent_count]`. Measures time and allocated memory to load the
+cache and complete one name, for a synthetic namespace of `parent_count` parents with 40-200 members each.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from spc import completion_cache
+
+COMMON_MEMBERS = ['constructor', 'toString', 'valueOf', 'hasOwnProperty', 'prototype', 'length', 'name']
+
+
+def synthetic_definitions(parent_count):
+    rng = random.Random(parent_count)
+    definitions = {'global': ['Parent{}'.format(i) for i in range(parent_count)]}
+    for i in range(parent_count):
+        members = COMMON_MEMBERS + ['member{}_{}'.format(i, j) for j in range(rng.randint(40, 200))]
+        definitions['Parent{}'.format(i)] = members
+    return definitions
+
+
+def load_json(path):
+    definitions = json.load(open(path))
+    del definitions['last_update']
+    return definitions['Parent1']
+
+
+def load_lazy(path):
+    return completion_cache.load(path)['Parent1']
+
+
+def measure(loader, path, rounds=5):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        loader(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    result = loader(path)
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return best, memory
+
+
+def main(parent_count):
+    definitions = synthetic_definitions(parent_count)
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'data.json')
+        lazy_path = os.path.join(directory, 'data.bin')
+        to_save = dict(definitions)
+        to_save['last_update'] = round(time.time())
+        json.dump(to_save, open(json_path, 'w'))
+        completion_cache.save(lazy_path, definitions, round(time.time()))
+
+        for name, loader, path in (('json', load_json, json_path), ('completion_cache', load_lazy, lazy_path)):
+            elapsed, memory = measure(loader, path)
+            print('{:<17} {:>6} parents, {:>9} bytes on disk: load {:.5f}s, peak {:>10} bytes allocated'.format(
+                name, parent_count, os.path.getsize(path), elapsed, memory))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,114 @@
+"""
+Replays websocket frames through the old nested-loop message handling and through `MessageDispatcher`.
+
+Run with `python -m benchmarks.bench_dispatch [frames_file]`. The file should contain one raw frame per line; without
+one, synthetic console traffic is generated. Output is sent to a counting sink, so this only measures dispatch.
+"""
+import json
+import sys
+import time
+
+from spc import dispatch
+
+KEYWORD = '__ld_bench:'
+
+
+def synthetic_frames(count=2000, lines_per_frame=50):
+    frames = []
+    for i in range(count):
+        if i % 10 == 0:
+            frames.append('time {}'.format(i))
+        frames.append(json.dumps(['user:bench/console', {
+            'messages': {
+                'log': ['[{}] creep {} harvesting'.format(i, j) for j in range(lines_per_frame)],
+                'results': ['{}'.format(i)] if i % 5 == 0 else [],
+            },
+            'shard': 'shard0',
+        }]))
+    return frames
+
+
+class Sink:
+    def __init__(self):
+        self.count = 0
+
+    def one(self, text, source='log'):
+        self.count += 1
+
+    def many(self, texts, source='log'):
+        self.count += len(texts)
+
+
+def is_definition(message):
+    return message.lstrip().startswith(KEYWORD)
+
+
+def legacy_dispatch(message, sink):
+    # Copy of the pre-dispatcher recv_loop body.
+    try:
+        message_json = json.loads(message)
+    except ValueError:
+        if not message.startswith('time ') and not message.startswith('protocol ') \
+                and not message.startswith('package '):
+            sink.one(message, 'unknown')
+        return
+    if len(message_json) != 2:
+        sink.one(message, 'unknown')
+        return
+    for general_type, stuff in message_json[1].items():
+        if isinstance(stuff, str):
+            sink.one(stuff, general_type)
+        elif isinstance(stuff, dict):
+            for specific_type, text_list in stuff.items():
+                if len(text_list):
+                    if isinstance(text_list, list):
+                        for text in text_list:
+                            if general_type == 'messages' and specific_type == 'results':
+                                if not is_definition(text):
+                                    sink.one(text, 'results')
+                            elif general_type == 'messages' and specific_type == 'log':
+                                sink.one(text)
+                            else:
+                                sink.one(text, specific_type)
+                    else:
+                        sink.one(str(text_list), specific_type)
+        else:
+            sink.one(str(stuff), general_type)
+
+
+def run_legacy(frames):
+    sink = Sink()
+    for frame in frames:
+        legacy_dispatch(frame, sink)
+    return sink.count
+
+
+def run_dispatcher(frames):
+    sink = Sink()
+    dispatcher = dispatch.MessageDispatcher(sink.many, sink.one)
+    dispatcher.register('messages', 'log', sink.many)
+    dispatcher.register('messages', 'results', sink.many)
+    for frame in frames:
+        dispatcher.dispatch(frame)
+    return sink.count
+
+
+def main(frames, rounds=5):
+    for name, runner in (('legacy nested loop', run_legacy), ('MessageDispatcher', run_dispatcher)):
+        best = None
+        count = 0
+        for _ in range(rounds):
+            start = time.perf_counter()
+            count = runner(frames)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('{:<20} {:>6} frames, {:>7} lines in {:.4f}s: {:>10.0f} frames/sec'.format(
+            name, len(frames), count, best, len(frames) / best))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            main([line.rstrip('\n') for line in f if line.strip()])
+    else:
+        main(synthetic_frames())
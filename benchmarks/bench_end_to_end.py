@@ -0,0 +1,155 @@
+"""
+End-to-end benchmarks of `ActiveConnection` against the local stub server:
+
+- throughput: log messages/sec from websocket frame to message handler
+- latency: round trip from `send_command` to its result arriving, p50/p99
+- crawl: time for `autocompletion.initialize_all` to crawl a synthetic namespace
+
+Run with `python -m benchmarks.bench_end_to_end [frames_file]`. With a file of recorded frames (one per line), those
+are replayed for the throughput benchmark instead of synthetic traffic.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_server import StubServer, load_frames, log_frames
+from spc import autocompletion, communication, interface
+
+keyword_regex = re.compile('"(__ld_\\w+:)')
+
+
+def create_connection(loop, server):
+    return communication.ActiveConnection(loop, 'bench', 'bench', server.ws_url, server.api_url,
+                                          rate_limit_per_hour=10 ** 9)
+
+
+@asyncio.coroutine
+def wait_until_ready(loop, server, connection):
+    yield from connection.connect()
+    yield from server.wait_for_subscriber()
+    while connection.state != communication.STATE_READY:
+        yield from asyncio.sleep(0.01, loop=loop)
+
+
+@asyncio.coroutine
+def bench_throughput(loop, frames):
+    server = StubServer(loop)
+    yield from server.start()
+    connection = create_connection(loop, server)
+    expected = sum(len(json.loads(frame)[1]['messages']['log']) for frame in frames)
+    received = [0]
+    finished = asyncio.Event(loop=loop)
+
+    def count(_, texts, *args):
+        received[0] += len(texts)
+        if received[0] >= expected:
+            finished.set()
+
+    connection.message_handler = count
+    yield from wait_until_ready(loop, server, connection)
+    start = time.perf_counter()
+    yield from server.replay(frames)
+    yield from finished.wait()
+    elapsed = time.perf_counter() - start
+    yield from connection.close()
+    yield from server.stop()
+    return 'throughput: {} messages in {:.3f}s, {:.0f} messages/sec'.format(expected, elapsed, expected / elapsed)
+
+
+@asyncio.coroutine
+def bench_latency(loop, count=200):
+    server = StubServer(loop)
+    yield from server.start()
+    connection = create_connection(loop, server)
+    waiting = {}
+
+    def resolve(_, texts, source, *args):
+        for text in texts:
+            if text in waiting:
+                waiting.pop(text).set_result(None)
+
+    connection.message_handler = resolve
+    yield from wait_until_ready(loop, server, connection)
+    latencies = []
+    for i in range(count):
+        text = 'latency {}'.format(i)
+        waiting[text] = asyncio.Future(loop=loop)
+        start = time.perf_counter()
+        yield from connection.send_command(text)
+        yield from waiting[text]
+        latencies.append(time.perf_counter() - start)
+    yield from connection.close()
+    yield from server.stop()
+    latencies.sort()
+    return 'latency: {} round trips, p50 {:.2f}ms, p99 {:.2f}ms'.format(
+        count, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000)
+
+
+def synthetic_namespace(object_count=200, member_count=30):
+    namespace = {'global': ['Object{}'.format(i) for i in range(object_count)]}
+    for i in range(object_count):
+        name = 'Object{}'.format(i)
+        namespace[name] = ['member{}'.format(j) for j in range(member_count)]
+        for j in range(member_count):
+            namespace['{}.member{}'.format(name, j)] = []
+    return namespace
+
+
+def crawl_handler(namespace):
+    def handle(expression):
+        names = json.loads(expression[:expression.index('.map(')])
+        keyword = keyword_regex.search(expression).group(1)
+        if 'charCodeAt' in expression:
+            lines = ['{}#{}={}:{}'.format(keyword, name, *autocompletion._fingerprint(namespace.get(name, [])))
+                     for name in names]
+        else:
+            lines = ['{}{}={}'.format(keyword, name, json.dumps(namespace.get(name, []))) for name in names]
+        return ['\n'.join(lines)]
+
+    return handle
+
+
+@asyncio.coroutine
+def bench_crawl(loop):
+    namespace = synthetic_namespace()
+    server = StubServer(loop, console_handler=crawl_handler(namespace))
+    yield from server.start()
+    connection = create_connection(loop, server)
+    yield from wait_until_ready(loop, server, connection)
+    previous_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            start = time.perf_counter()
+            yield from autocompletion.initialize_all(loop, connection)
+            elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(previous_directory)
+    yield from connection.close()
+    yield from server.stop()
+    return 'crawl: {} parents in {:.3f}s using {} commands'.format(len(namespace), elapsed,
+                                                                  len(server.commands_received))
+
+
+@asyncio.coroutine
+def main(loop, frames):
+    results = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results.append((yield from bench_throughput(loop, frames)))
+        results.append((yield from bench_latency(loop)))
+        results.append((yield from bench_crawl(loop)))
+        interface.flush_output()
+    for result in results:
+        print(result)
+
+
+if __name__ == '__main__':
+    event_loop = asyncio.get_event_loop()
+    interface.initialize_output(event_loop)
+    event_loop.run_until_complete(main(event_loop, load_frames(sys.argv[1]) if len(sys.argv) > 1 else log_frames()))
+    event_loop.close()
@@ -0,0 +1,57 @@
+"""
+Compares console commands/sec between the old `run_in_executor(requests.post)` path and the pooled `ApiClient`.
+
+Run with `python -m benchmarks.bench_http [command_count]`. Needs `requests` installed for the baseline.
+"""
+import asyncio
+import functools
+import sys
+import time
+
+import requests
+
+from benchmarks.stub_server import StubServer, STUB_TOKEN
+from spc import api
+
+HEADERS = {'X-Username': STUB_TOKEN, 'X-Token': STUB_TOKEN}
+
+
+@asyncio.coroutine
+def run_executor(loop, server, count):
+    yield from asyncio.gather(*(loop.run_in_executor(None, functools.partial(
+        requests.post,
+        server.api_url + '/user/console',
+        headers=HEADERS,
+        json={'expression': 'Game.time'}
+    )) for _ in range(count)), loop=loop)
+
+
+@asyncio.coroutine
+def run_pooled(loop, server, count):
+    client = api.ApiClient(loop, server.api_url)
+    try:
+        yield from asyncio.gather(*(client.post('/user/console', {'expression': 'Game.time'}, headers=HEADERS)
+                                    for _ in range(count)), loop=loop)
+    finally:
+        yield from client.close()
+
+
+@asyncio.coroutine
+def main(loop, count):
+    server = StubServer(loop)
+    yield from server.start()
+    try:
+        for name, runner in (('executor + requests.post', run_executor), ('pooled ApiClient', run_pooled)):
+            start = time.perf_counter()
+            yield from runner(loop, server, count)
+            elapsed = time.perf_counter() - start
+            print('{:<26} {:>6} commands in {:.3f}s: {:>8.1f} commands/sec'.format(
+                name, count, elapsed, count / elapsed))
+    finally:
+        yield from server.stop()
+
+
+if __name__ == '__main__':
+    event_loop = asyncio.get_event_loop()
+    event_loop.run_until_complete(main(event_loop, int(sys.argv[1]) if len(sys.argv) > 1 else 500))
+    event_loop.close()
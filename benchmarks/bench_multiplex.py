@@ -0,0 +1,66 @@
+"""
+Measures the cost of each additional connection in a ConnectionGroup, with one local stub server per connection.
+
+Run with `python -m benchmarks.bench_multiplex [max_connections] [commands]`. For 1, 2, 4, ... connections, reports
+memory allocated per connection and the time to fan `commands` commands out to all of them.
+"""
+import asyncio
+import contextlib
+import os
+import sys
+import time
+import tracemalloc
+
+from benchmarks.stub_server import StubServer
+from spc import interface, multiplex
+
+
+@asyncio.coroutine
+def run(loop, connection_count, command_count):
+    servers = [StubServer(loop, shard='shard{}'.format(i)) for i in range(connection_count)]
+    for server in servers:
+        yield from server.start()
+    config = {
+        'user': 'bench', 'password': 'bench',
+        'rate_limit_per_hour': 10 ** 9,
+        'connections': [{'name': 'conn{}'.format(i), 'ws_url': server.ws_url, 'api_url': server.api_url}
+                        for i, server in enumerate(servers)],
+    }
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    group = multiplex.ConnectionGroup.from_config(loop, config)
+    yield from group.connect()
+    while not all(connection.state == 'ready' for connection in group.connections):
+        yield from asyncio.sleep(0.01, loop=loop)
+    connected = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    yield from asyncio.gather(*(group.send_command('@all {}'.format(i)) for i in range(command_count)), loop=loop)
+    interface.flush_output()
+    elapsed = time.perf_counter() - start
+
+    yield from group.close()
+    for server in servers:
+        yield from server.stop()
+    return (connected - before) / connection_count, elapsed
+
+
+@asyncio.coroutine
+def main(loop, max_connections, command_count):
+    connection_count = 1
+    results = []
+    while connection_count <= max_connections:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results.append((connection_count,) + (yield from run(loop, connection_count, command_count)))
+        connection_count *= 2
+    for connection_count, memory, elapsed in results:
+        print('{:>3} connections: {:>8.0f} bytes allocated per connection, {} commands to all in {:.3f}s'.format(
+            connection_count, memory, command_count, elapsed))
+
+
+if __name__ == '__main__':
+    event_loop = asyncio.get_event_loop()
+    event_loop.run_until_complete(main(event_loop, int(sys.argv[1]) if len(sys.argv) > 1 else 16,
+                                       int(sys.argv[2]) if len(sys.argv) > 2 else 100))
+    event_loop.close()
@@ -0,0 +1,109 @@
+"""
+Startup benchmarks:
+
+- import: time to import everything `python -m spc` needs before showing the prompt, and time for the slow
+  dependencies (aiohttp, websockets) which are left until after it
+- prompt: time from starting `python -m spc` in a pseudo-terminal until the prompt is shown, and until the result of
+  a command typed as soon as the prompt appears comes back, against the stub server with slow HTTP responses
+
+Run with `python -m benchmarks.bench_startup`.
+"""
+import asyncio
+import json
+import os
+import pty
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_server import StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = (
+    'import json, sys, time\n'
+    'start = time.perf_counter()\n'
+    'from spc import api, autocompletion, communication, filters, interface, metrics, multiplex, scrollback\n'
+    'imported = time.perf_counter()\n'
+    'deferred = sorted(name for name in ("aiohttp", "websockets") if name not in sys.modules)\n'
+    'import aiohttp, websockets\n'
+    'print(json.dumps([imported - start, time.perf_counter() - imported, deferred]))\n'
+)
+
+
+def child_environment():
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+
+
+def bench_import(runs=5):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], env=child_environment())
+        timings.append(json.loads(output.decode()))
+    timings.sort()
+    before_prompt, after_prompt, deferred = timings[len(timings) // 2]
+    return 'import: {:.1f}ms before the prompt, {:.1f}ms deferred ({})'.format(
+        before_prompt * 1000, after_prompt * 1000, ', '.join(deferred) or 'nothing')
+
+
+@asyncio.coroutine
+def bench_prompt(loop, latency=0.2):
+    """
+    :param latency: Seconds each stub HTTP request takes, so logging in takes at least twice this.
+    """
+    server = StubServer(loop, latency=latency, console_handler=lambda expression: ['=> ' + expression])
+    yield from server.start()
+    seen = {}
+    finished = asyncio.Event(loop=loop)
+    output = bytearray()
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'console.json'), 'w') as f:
+            json.dump({'user': 'bench', 'password': 'bench', 'ws_url': server.ws_url, 'api_url': server.api_url}, f)
+        master, slave = pty.openpty()
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-m', 'spc'], stdin=slave, stdout=slave, stderr=slave,
+                                   cwd=directory, env=child_environment())
+        os.close(slave)
+
+        def read():
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                data = b''
+            if not data:
+                loop.remove_reader(master)
+                finished.set()
+                return
+            output.extend(data)
+            if 'prompt' not in seen and b'> ' in output:
+                seen['prompt'] = time.perf_counter() - start
+                os.write(master, b'marker\r')
+            if 'result' not in seen and b'=> marker' in output:
+                seen['result'] = time.perf_counter() - start
+                finished.set()
+
+        loop.add_reader(master, read)
+        try:
+            yield from asyncio.wait_for(finished.wait(), 30, loop=loop)
+        finally:
+            loop.remove_reader(master)
+            # End of input, so the console exits by itself.
+            os.write(master, b'\x04')
+            try:
+                yield from asyncio.wait_for(loop.run_in_executor(None, process.wait), 10, loop=loop)
+            except asyncio.TimeoutError:
+                process.kill()
+            os.close(master)
+    yield from server.stop()
+    if 'result' not in seen:
+        return 'prompt: console never showed a result, output was {!r}'.format(bytes(output[-500:]))
+    return 'prompt: shown after {:.0f}ms, first result after {:.0f}ms (each HTTP request takes {:.0f}ms)'.format(
+        seen['prompt'] * 1000, seen['result'] * 1000, latency * 1000)
+
+
+if __name__ == '__main__':
+    print(bench_import())
+    event_loop = asyncio.get_event_loop()
+    print(event_loop.run_until_complete(bench_prompt(event_loop)))
+    event_loop.close()
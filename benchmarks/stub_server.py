@@ -0,0 +1,186 @@
+"""
+Local stand-in for the screeps API and websocket, for benchmarking without touching the live servers.
+
+Speaks the parts of the protocol `ActiveConnection` uses: `/auth/signin`, `/auth/me` and `/user/console` over HTTP,
+and `auth`/`subscribe user:<id>/console` over the websocket, replying with `auth ok <token>` and console frames. Log
+traffic, recorded or synthetic, can be replayed to subscribers at a fixed rate with `replay`.
+"""
+import asyncio
+import json
+import time
+
+import aiohttp
+from aiohttp import web
+
+STUB_TOKEN = 'stub-token'
+STUB_USER_ID = 'stub-user'
+
+
+def echo_console(expression):
+    return [expression]
+
+
+def log_frames(lines_per_frame=50, frame_count=1000, shard='shard0'):
+    """
+    Synthetic console log traffic, as raw frames.
+
+    :rtype: list[str]
+    """
+    return [json.dumps(['user:{}/console'.format(STUB_USER_ID), {
+        'messages': {'log': ['[{}] creep {} harvesting'.format(i, j) for j in range(lines_per_frame)], 'results': []},
+        'shard': shard,
+    }]) for i in range(frame_count)]
+
+
+def load_frames(path):
+    """
+    Reads recorded traffic: one raw websocket frame per line.
+
+    :rtype: list[str]
+    """
+    with open(path) as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+
+class StubServer:
+    """
+    :type _loop: asyncio.events.AbstractEventLoop
+    :type latency: float
+    :type commands_received: list[str]
+    :type _console_handler: (str) -> list[str]
+    :type _subscribed: set[aiohttp.web.WebSocketResponse]
+    """
+
+    def __init__(self, loop, host='127.0.0.1', port=0, latency=0, shard='shard0', console_handler=echo_console):
+        """
+        :param latency: Seconds each HTTP request takes.
+        :param console_handler: Called with each console expression, returning the results to send back.
+        """
+        self._loop = loop
+        self._host = host
+        self._port = port
+        self.latency = latency
+        self.shard = shard
+        self._console_handler = console_handler
+        self.commands_received = []
+        self._subscribed = set()
+        self._app = web.Application(loop=loop)
+        self._app.router.add_get('/socket/websocket', self._websocket)
+        self._app.router.add_post('/api/auth/signin', self._signin)
+        self._app.router.add_get('/api/auth/me', self._me)
+        self._app.router.add_post('/api/user/console', self._console)
+        self._handler = None
+        self._server = None
+
+    @property
+    def api_url(self):
+        return 'http://{}:{}/api'.format(self._host, self._port)
+
+    @property
+    def ws_url(self):
+        return 'ws://{}:{}/socket/websocket'.format(self._host, self._port)
+
+    @asyncio.coroutine
+    def _websocket(self, request):
+        socket = web.WebSocketResponse()
+        yield from socket.prepare(request)
+        try:
+            while True:
+                message = yield from socket.receive()
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                if message.data.startswith('auth '):
+                    yield from socket.send_str('auth ok {}'.format(STUB_TOKEN))
+                elif message.data == 'subscribe user:{}/console'.format(STUB_USER_ID):
+                    self._subscribed.add(socket)
+        finally:
+            self._subscribed.discard(socket)
+        return socket
+
+    @asyncio.coroutine
+    def send_console(self, log=(), results=()):
+        """
+        Sends one console frame to every subscribed websocket.
+        """
+        frame = json.dumps(['user:{}/console'.format(STUB_USER_ID), {
+            'messages': {'log': list(log), 'results': list(results)},
+            'shard': self.shard,
+        }])
+        yield from self.send_frame(frame)
+
+    @asyncio.coroutine
+    def send_frame(self, frame):
+        for socket in list(self._subscribed):
+            yield from socket.send_str(frame)
+
+    @asyncio.coroutine
+    def drop_connections(self):
+        """
+        Closes every subscribed websocket, as the server does when it restarts.
+        """
+        for socket in list(self._subscribed):
+            self._subscribed.discard(socket)
+            yield from socket.close()
+
+    @asyncio.coroutine
+    def wait_for_subscriber(self):
+        while not self._subscribed:
+            yield from asyncio.sleep(0.01, loop=self._loop)
+
+    @asyncio.coroutine
+    def replay(self, frames, rate=None):
+        """
+        Sends raw frames to every subscriber, `rate` frames per second or as fast as possible if not given.
+
+        :type frames: collections.Iterable[str]
+        :return: Number of frames sent
+        """
+        start = time.perf_counter()
+        sent = 0
+        for frame in frames:
+            if rate:
+                wait = start + sent / rate - time.perf_counter()
+                if wait > 0:
+                    yield from asyncio.sleep(wait, loop=self._loop)
+            yield from self.send_frame(frame)
+            sent += 1
+        return sent
+
+    @asyncio.coroutine
+    def _delay(self):
+        if self.latency:
+            yield from asyncio.sleep(self.latency, loop=self._loop)
+
+    @asyncio.coroutine
+    def _signin(self, request):
+        yield from self._delay()
+        return web.json_response({'ok': 1, 'token': STUB_TOKEN})
+
+    @asyncio.coroutine
+    def _me(self, request):
+        yield from self._delay()
+        return web.json_response({'ok': 1, '_id': STUB_USER_ID})
+
+    @asyncio.coroutine
+    def _console(self, request):
+        body = yield from request.json()
+        yield from self._delay()
+        self.commands_received.append(body['expression'])
+        asyncio.ensure_future(self.send_console(results=self._console_handler(body['expression'])), loop=self._loop)
+        return web.json_response({'ok': 1, 'result': {'ok': 1}}, headers={'X-Token': STUB_TOKEN})
+
+    @asyncio.coroutine
+    def start(self):
+        self._handler = self._app.make_handler(loop=self._loop)
+        self._server = yield from self._loop.create_server(self._handler, self._host, self._port)
+        self._port = self._server.sockets[0].getsockname()[1]
+
+    @asyncio.coroutine
+    def stop(self):
+        for socket in list(self._subscribed):
+            yield from socket.close()
+        self._server.close()
+        yield from self._server.wait_closed()
+        yield from self._app.shutdown()
+        yield from self._handler.shutdown(1)
+        yield from self._app.cleanup()
@@ -1,33 +1,145 @@
+import argparse
 import asyncio
 import json
-
 import os
+import stat
+import sys
+
+from spc import api, interface, autocompletion, chunked, execute, filters, history, metrics, multiplex, scrollback
 
-from spc import interface, communication, autocompletion
+parser = argparse.ArgumentParser(prog='python -m spc', description="Screeps console.")
+parser.add_argument('--stream', metavar='FILE', nargs='?', const='-',
+                    help="don't start the interactive console, instead write every console message as a JSON line to "
+                         "FILE (stdout if not given)")
+parser.add_argument('--rotate-bytes', type=int, help="with --stream, rotate FILE once it's this large")
+parser.add_argument('--rotate-seconds', type=int, help="with --stream, rotate FILE once it's been open this long")
+parser.add_argument('--gzip', action='store_true', help="with --stream, gzip compress rotated files")
+parser.add_argument('--metrics', metavar='FILE', help="write collected metrics to FILE as JSON on exit")
+parser.add_argument('--exec', metavar='FILE', dest='exec_file',
+                    help="run each line of FILE ('-' for stdin) as an expression, print the results in order and exit. "
+                         "Used by default when stdin is a pipe or a file")
+parser.add_argument('--concurrency', type=int, help="with --exec, expressions waiting for results at once (default {})"
+                    .format(execute.DEFAULT_CONCURRENCY))
+parser.add_argument('--timeout', type=float, help="with --exec, seconds to wait for each result (default {})"
+                    .format(execute.DEFAULT_TIMEOUT))
+args = parser.parse_args()
 
-interface.initialize_readline(autocompletion.completions_for)
+if args.exec_file is None and args.stream is None:
+    # Only for input piped or redirected from a file: stdin can also be /dev/null or an IDE's console, which aren't
+    # terminals either, but aren't meant as a list of expressions.
+    stdin_mode = os.fstat(sys.stdin.fileno()).st_mode
+    if stat.S_ISFIFO(stdin_mode) or stat.S_ISREG(stdin_mode):
+        args.exec_file = '-'
+interactive = args.stream is None and args.exec_file is None
 
 loop = asyncio.get_event_loop()
 
 config = json.load(open('console.json'))
 
-connection = communication.ActiveConnection(loop, config['user'], config['password'],
-                                            config.get('ws_url'), config.get('api_url'))
+if interactive:
+    interface.initialize_readline(autocompletion.completions_for)
+    history.load(config.get('history_file'), config.get('history_size'))
+
+interface.initialize_output(loop, config.get('output_flush_interval'), config.get('output_backlog'),
+                            None if interactive else sys.stderr)
+
+filters.load_config(config.get('filters'))
+scrollback.configure(config.get('scrollback_lines'), config.get('scrollback_bytes'))
+
+connections = multiplex.ConnectionGroup.from_config(loop, config)
+
+metrics.gauge('pending_commands', lambda: sum(connection.pending_commands()
+                                              for connection in connections.connections))
+interface.register_meta_command('stats', lambda arguments: [interface.output_text(line, False)
+                                                            for line in metrics.report()],
+                                "show latencies, rates and queue sizes")
+interface.register_meta_command('filter', filters.command, "list or change log filters, see ':filter help'")
+metrics.gauge('filtered_lines', filters.suppressed)
+interface.register_meta_command('dump', lambda arguments: chunked.command(loop, connections.default, arguments),
+                                "evaluate a large result and page it, or write it to a file with ':dump >FILE'")
+interface.register_meta_command('more', lambda arguments: chunked.show_page(), "show the next page of ':dump'")
+interface.register_meta_command('search', scrollback.command,
+                                "search earlier output: ':search [-since TIME] [-until TIME] [PATTERN]'")
+
+
+def run_cached(arguments):
+    asyncio.ensure_future(connections.send_command(arguments, cached=True), loop=loop)
+
+
+interface.register_meta_command('cached', run_cached,
+                                "run a repeatable expression, reusing its result from this tick if there is one")
+
+sink = None
+if args.stream is not None:
+    # Only imported when streaming, to keep startup fast.
+    from spc import stream
+    sink = stream.JsonlSink(loop, args.stream, args.rotate_bytes, args.rotate_seconds, args.gzip)
+    for connection in connections.connections:
+        connection.message_handler = sink.handle_messages
+
+
+@asyncio.coroutine
+def connect():
+    """
+    Runs in the background while the prompt is already shown. Anything sent before it's done is queued.
+
+    :return: False if logging in failed for good, otherwise True.
+    """
+    try:
+        yield from connections.connect()
+    except (api.ApiError, ValueError) as e:
+        interface.output_text("Failed to log in: {}".format(e), False)
+        interface.request_exit()
+        return False
+    return True
 
 
 @asyncio.coroutine
 def start():
-    yield from connection.connect()
     interface.initialize_signal_handlers(loop)
-    yield from asyncio.gather(
-        interface.input_loop(loop, connection),
-        autocompletion.initialize_all(loop, connection),
-        loop=loop
-    )
+    connecting = asyncio.ensure_future(connect(), loop=loop)
+    try:
+        exit_code = yield from run()
+    finally:
+        connecting.cancel()
+    if connecting.done() and not connecting.cancelled() and not connecting.result():
+        return execute.EXIT_FAILED
+    return exit_code
+
+
+@asyncio.coroutine
+def run():
+    if sink is not None:
+        yield from interface.wait_for_exit()
+    elif args.exec_file is not None:
+        if args.exec_file == '-':
+            expressions = execute.read_expressions(sys.stdin)
+        else:
+            with open(args.exec_file) as file:
+                expressions = execute.read_expressions(file)
+        batch = asyncio.ensure_future(execute.BatchRun(loop, connections.default, expressions, args.concurrency,
+                                                     args.timeout).run(), loop=loop)
+        exit_required = asyncio.ensure_future(interface.wait_for_exit(), loop=loop)
+        yield from asyncio.wait([batch, exit_required], loop=loop, return_when=asyncio.FIRST_COMPLETED)
+        exit_required.cancel()
+        if not batch.done():
+            batch.cancel()
+            return execute.EXIT_INTERRUPTED
+        return batch.result()
+    else:
+        completion = asyncio.ensure_future(autocompletion.initialize_all(loop, connections.default), loop=loop)
+        yield from interface.input_loop(loop, connections)
+        completion.cancel()
 
 
 main_task = asyncio.ensure_future(start())
 loop.run_until_complete(main_task)
-loop.run_until_complete(connection.close())
+loop.run_until_complete(connections.close())
+if sink is not None:
+    loop.run_until_complete(sink.close())
+interface.flush_output()
+history.close()
+if args.metrics:
+    metrics.dump(args.metrics)
 loop.close()
-os._exit(0)
+sys.exit(main_task.result())
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import time
+
+from spc import metrics
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 30
+
+
+class ApiConnectionError(ConnectionError):
+    """
+    The request couldn't be sent at all, so it's safe to send again.
+    """
+
+
+class ApiNoResponseError(ConnectionError):
+    """
+    The request was, or might have been, sent but no response came back, so the server may or may not have acted on it.
+    """
+
+
+class ApiError(Exception):
+    def __init__(self, response):
+        super().__init__("HTTP Error {}: {}".format(response.status_code, response.reason))
+        self.response = response
+
+
+class ApiResponse:
+    """
+    A fully read response, shaped like a `requests.Response` so callers don't need to care which transport is used.
+
+    :type status_code: int
+    :type reason: str
+    :type headers: multidict.CIMultiDictProxy
+    :type text: str
+    """
+
+    def __init__(self, status_code, reason, headers, text):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.text = text
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise ApiError(self)
+
+
+def create_session(loop, concurrency=None):
+    """
+    Creates an aiohttp session with one keep-alive connection pool.
+
+    :type loop: asyncio.events.AbstractEventLoop
+    :param concurrency: Maximum connections open at once over all clients using the session.
+    :rtype: aiohttp.ClientSession
+    """
+    # Imported here since it's slow to import, and not needed until the first request.
+    import aiohttp
+    connector = aiohttp.TCPConnector(limit=concurrency or DEFAULT_CONCURRENCY, loop=loop)
+    return aiohttp.ClientSession(connector=connector, loop=loop)
+
+
+class SharedSession:
+    """
+    One session shared between several ApiClients. It's only created on the first request, inside the event loop, so
+    aiohttp isn't imported before it's needed.
+
+    :type _loop: asyncio.events.AbstractEventLoop
+    :type _session: aiohttp.ClientSession
+    """
+
+    def __init__(self, loop, concurrency=None):
+        """
+        :param concurrency: Maximum connections open at once over all clients using the session.
+        """
+        self._loop = loop
+        self._concurrency = concurrency
+        self._session = None
+
+    def get(self):
+        """
+        :rtype: aiohttp.ClientSession
+        """
+        if self._session is None or self._session.closed:
+            self._session = create_session(self._loop, self._concurrency)
+        return self._session
+
+    @asyncio.coroutine
+    def close(self):
+        if self._session is not None:
+            session = self._session
+            self._session = None
+            yield from session.close()
+
+
+class ApiClient:
+    """
+    Pooled HTTP client for the screeps API. One keep-alive connection pool is shared by every request, and at most
+    `concurrency` requests are in flight at once. The pool can also be shared with other clients by passing in a
+    `SharedSession`.
+
+    :type _loop: asyncio.events.AbstractEventLoop
+    :type _api_url: str
+    :type _timeout: float
+    :type _session: aiohttp.ClientSession
+    :type _shared_session: SharedSession
+    """
+
+    def __init__(self, loop, api_url, concurrency=None, timeout=None, session=None):
+        """
+        :param session: Shared session to use, which this client won't close.
+        :type session: SharedSession
+        """
+        self._loop = loop
+        self._api_url = api_url
+        self._timeout = timeout or DEFAULT_TIMEOUT
+        self._concurrency = concurrency or DEFAULT_CONCURRENCY
+        self._semaphore = asyncio.Semaphore(self._concurrency, loop=loop)
+        self._session = None
+        self._shared_session = session
+
+    def _get_session(self):
+        if self._shared_session is not None:
+            return self._shared_session.get()
+        if self._session is None or self._session.closed:
+            self._session = create_session(self._loop, self._concurrency)
+        return self._session
+
+    @asyncio.coroutine
+    def _request(self, method, path, headers=None, json_data=None):
+        response = yield from self._get_session().request(method, self._api_url + path,
+                                                          headers=headers, json=json_data)
+        try:
+            text = yield from response.text()
+        finally:
+            response.release()
+        return ApiResponse(response.status, response.reason, response.headers, text)
+
+    @asyncio.coroutine
+    def request(self, method, path, headers=None, json_data=None, timeout=None):
+        """
+        :type method: str
+        :type path: str
+        :type headers: dict[str, str]
+        :param json_data: Object to send as the JSON body, if any.
+        :param timeout: Timeout in seconds for this request, overriding the client default.
+        :rtype: ApiResponse
+        :raises ApiConnectionError: If the request couldn't be sent.
+        :raises ApiNoResponseError: If it timed out, or the connection failed after it might have been sent.
+        """
+        import aiohttp
+        with (yield from self._semaphore):
+            start = time.perf_counter()
+            try:
+                response = yield from asyncio.wait_for(self._request(method, path, headers, json_data),
+                                                       timeout or self._timeout, loop=self._loop)
+                metrics.observe('http_request', time.perf_counter() - start)
+                return response
+            except asyncio.TimeoutError:
+                raise ApiNoResponseError("Timed out requesting {}".format(path))
+            except aiohttp.ClientConnectorError as e:
+                raise ApiConnectionError(str(e)) from e
+            except aiohttp.ClientError as e:
+                raise ApiNoResponseError(str(e)) from e
+
+    @asyncio.coroutine
+    def get(self, path, headers=None, timeout=None):
+        return (yield from self.request('GET', path, headers=headers, timeout=timeout))
+
+    @asyncio.coroutine
+    def post(self, path, json_data=None, headers=None, timeout=None):
+        return (yield from self.request('POST', path, headers=headers, json_data=json_data, timeout=timeout))
+
+    @asyncio.coroutine
+    def close(self):
+        if self._session is not None:
+            session = self._session
+            self._session = None
+            yield from session.close()
@@ -1,27 +1,163 @@
+import array
 import asyncio
-import itertools
+import bisect
+import collections
 import json
-import string
+import re
 import time
 import traceback
 
 import functools
-import os
-import random
-import re
+import sys
+
+from spc import completion_cache, crawler, interface, metrics, ratelimit, tagged
 
-from spc import interface
+CACHE_FILE = '.autocomplete_data.bin'
+# Refresh every 5 days
+CACHE_EXPIRY = 60 * 60 * 24 * 5
+# Replies with `<keyword><name>=<JSON list of member names>` for each name.
+DEFINITION_COMMAND = (
+    '{names}.map(w=>"{keyword}"+w+"="+JSON.stringify(_.get(global,w)?Object.getOwnPropertyNames(_.get(global,w)):[]))'
+    '.join("\\n")'
+)
+# Replies with `<keyword>#<name>=<member count>:<hash>` for each name, see _fingerprint.
+FINGERPRINT_COMMAND = (
+    '{names}.map(w=>{{let n=_.get(global,w);n=n?Object.getOwnPropertyNames(n):[];let s=n.join(","),h=0;'
+    'for(let i=0;i<s.length;i++)h=(h*31+s.charCodeAt(i))|0;return "{keyword}#"+w+"="+n.length+":"+h}})'
+    '.join("\\n")'
+)
+
+# Replies with `<keyword><path>=<JSON [own members, [[prototype name, members or null if known], ...]]>`, or
+# `<keyword><path>=null` if there's nothing there.
+MEMBERS_COMMAND = (
+    '(()=>{{let w={path},o=_.get(global,w),k={known},c=[];if(o==null)return "{keyword}"+w+"=null";'
+    'for(let p=Object.getPrototypeOf(Object(o));p&&p!==Object.prototype;p=Object.getPrototypeOf(p)){{'
+    'let n=p.hasOwnProperty("constructor")&&p.constructor.name||"";'
+    'c.push([n,n&&k.includes(n)?null:Object.getOwnPropertyNames(p)])}}'
+    'return "{keyword}"+w+"="+JSON.stringify([Object.getOwnPropertyNames(Object(o)),c])}})()'
+)
+# Paths fetched on demand when completing further than the crawled definitions go
+DEEP_CACHE_SIZE = 256
+# Seconds before a fetch with no reply can be sent again
+FETCH_TIMEOUT = 30
+_path_regex = re.compile(r'^[A-Za-z_$][\w$]*(?:\.[\w$]+)+$')
 
 _autocomplete_definitions = {}
-_now_initializing = set()
-_needs_initialization_next = set()
-_rewake_condition = None
+_completion_indexes = {}
+_stale = set()
+_crawler = None
+_fingerprinter = None
 _keyword = ''
+# path -> (own member index, prototype names), least recently used first
+_deep_paths = collections.OrderedDict()
+# Shared between every deep path whose prototype chain includes them
+_prototype_indexes = {}
+_prototype_references = collections.Counter()
+# path -> time the fetch for it was sent
+_pending_paths = {}
+_fetch_loop = None
+_fetch_connection = None
+_fetch_keyword = tagged.new_keyword('__lm_')
+
+
+class _CompletionIndex:
+    """
+    Members of one parent object, sorted by their casefolded names so that prefix lookups are two bisects.
+    """
+    __slots__ = ('_keys', '_words')
+
+    def __init__(self, words):
+        pairs = sorted((word.casefold(), word) for word in words)
+        self._keys = [key for key, _ in pairs]
+        self._words = [word for _, word in pairs]
+
+    def starting_with(self, text):
+        """
+        :type text: str
+        :rtype: list[str]
+        """
+        key = text.casefold()
+        start = bisect.bisect_left(self._keys, key)
+        end = bisect.bisect_left(self._keys, key + '\U0010ffff', start)
+        return self._words[start:end]
+
+
+def _set_definitions(definitions):
+    global _autocomplete_definitions, _completion_indexes
+    _autocomplete_definitions = definitions
+    _completion_indexes = {}
+    completions_for.cache_clear()
+
+
+def _set_definition(name, completions):
+    _autocomplete_definitions[name] = completions
+    _completion_indexes.pop(name, None)
+    completions_for.cache_clear()
+
+
+def _index_for(parent):
+    index = _completion_indexes.get(parent)
+    if index is None:
+        words = _autocomplete_definitions.get(parent)
+        if words is None:
+            return None
+        index = _completion_indexes[parent] = _CompletionIndex(words)
+    return index
+
+
+def _fingerprint(members):
+    """
+    Python version of the hash FINGERPRINT_COMMAND calculates in JS: a 31-multiplier hash over the UTF-16 code units
+    of the comma-joined member names, wrapping at 32 bits.
+
+    :type members: list[str]
+    :rtype: (int, int)
+    """
+    code_units = array.array('H', ','.join(members).encode('utf-16-le'))
+    if sys.byteorder != 'little':
+        code_units.byteswap()
+    result = 0
+    for unit in code_units:
+        result = (result * 31 + unit) & 0xFFFFFFFF
+    if result >= 0x80000000:
+        result -= 0x100000000
+    return len(members), result
+
 
+@asyncio.coroutine
+def _find_changed_parents(loop, connection):
+    """
+    Asks the server for a fingerprint of every loaded parent, and marks those which differ (or never answer) as stale.
+
+    :type loop: asyncio.events.AbstractEventLoop
+    :type connection: spc.communication.ActiveConnection
+    """
+    global _fingerprinter
 
-def _group_words_by(words, by):
-    iterable = iter(words)
-    return iter(lambda: list(itertools.islice(iterable, by)), [])
+    @asyncio.coroutine
+    def send_chunk(names):
+        yield from connection.send_command(FINGERPRINT_COMMAND.format(names=json.dumps(names), keyword=_keyword),
+                                           ratelimit.PRIORITY_BACKGROUND)
+
+    _fingerprinter = crawler.CrawlScheduler(loop, send_chunk, chunk_size=50, max_chunk_size=200)
+    _fingerprinter.add(_autocomplete_definitions)
+    yield from _fingerprinter.run()
+    _stale.update(_fingerprinter.failed)
+    _fingerprinter = None
+
+
+def _load_fingerprint(text):
+    name, value = text.split('=', 1)
+    try:
+        count, fingerprint_hash = (int(part) for part in value.split(':', 1))
+    except ValueError:
+        interface.output_text('Failed to decode autocomplete fingerprint response! (data: `{}`)'.format(value))
+        return
+    if _fingerprinter is None or not _fingerprinter.is_pending(name):
+        return
+    if _fingerprint(_autocomplete_definitions.get(name, [])) != (count, fingerprint_hash):
+        _stale.add(name)
+    _fingerprinter.received(name, len(text))
 
 
 @asyncio.coroutine
@@ -30,95 +166,174 @@ def initialize_all(loop, connection):
     :type loop: asyncio.events.AbstractEventLoop
     :type connection: spc.communication.ActiveConnection
     """
-    global _autocomplete_definitions, _now_initializing, _needs_initialization_next, _keyword, _rewake_condition
+    global _crawler, _keyword, _fetch_loop, _fetch_connection
+    _fetch_loop = loop
+    _fetch_connection = connection
+
+    # Load cached data if available and recent enough. Member lists are only decoded when first completed.
+    loaded_definitions = completion_cache.load(CACHE_FILE)
+    if loaded_definitions is not None and time.time() - loaded_definitions.last_update <= CACHE_EXPIRY:
+        _set_definitions(loaded_definitions)
+        return
 
-    # Load cached data if available and recent enough
+    _stale.clear()
+    _keyword = tagged.new_keyword('__ld_')
+
+    @asyncio.coroutine
+    def send_chunk(names):
+        yield from connection.send_command(DEFINITION_COMMAND.format(names=json.dumps(names), keyword=_keyword),
+                                           ratelimit.PRIORITY_BACKGROUND)
+
+    _crawler = crawler.CrawlScheduler(loop, send_chunk)
     try:
-        loaded_definitions = json.load(open('.autocomplete_data.json'))
-    except (FileNotFoundError, ValueError):
-        pass
+        if loaded_definitions is not None:
+            # The old data keeps serving completions while only the parents which changed are crawled again.
+            interface.output_text("Refreshing autocompletion data.")
+            _set_definitions(loaded_definitions)
+            yield from _find_changed_parents(loop, connection)
+            _crawler.add(sorted(_stale))
+        else:
+            interface.output_text("Creating autocompletion data.")
+            _set_definitions({})
+            _crawler.add(['global'])
+
+        yield from _crawler.run()
+        done, _, failed = _crawler.progress()
+    finally:
+        _keyword = ''
+        _crawler = None
+
+    if failed:
+        interface.output_text("Finished loading autocompletion data: {} loaded, {} failed - saving to {}.".format(
+            done, failed, CACHE_FILE))
     else:
-        last_updated = loaded_definitions['last_update']
-        # Update every 5 days
-        if last_updated - time.time() <= 60 * 60 * 24 * 5:
-            del loaded_definitions['last_update']
-            _autocomplete_definitions = loaded_definitions
-            return
-
-    interface.output_text("Creating autocompletion data.")
-
-    _autocomplete_definitions = {}
-    _now_initializing = set()
-    _needs_initialization_next = {'global'}
-    _keyword = '__ld_{}:'.format(''.join(random.choice(string.ascii_uppercase + string.ascii_lowercase
-                                                       + string.digits) for _ in range(5)))
-    _rewake_condition = asyncio.Condition(loop=loop)
-    while True:
-        yield from _rewake_condition.acquire()
-        try:
-            all_needed_iterate = iter(set(x for x in itertools.chain(_now_initializing, _needs_initialization_next)
-                                          if x not in _autocomplete_definitions))
-            _now_initializing = set(itertools.islice(all_needed_iterate, 0, 100))
-            _needs_initialization_next = set(itertools.islice(all_needed_iterate, 200, None))
-
-            if _now_initializing:
-                command_futures = []
-                for chunk_of_words in _group_words_by(_now_initializing, 20):
-                    command = (
-                        '[{}].map(w=>"{}"+w+"="+JSON.stringify(_.get(global,w)?'
-                        'Object.getOwnPropertyNames(_.get(global,w)):[])).join("\\n")'.format(
-                            ','.join('"{}"'.format(word) for word in chunk_of_words),
-                            _keyword
-                        )
-                    )
-                    command_futures.append(connection.send_command(command))
-
-                # If a minute has passed, just re-send any remaining requests
-                # TODO: hacky way of setting a timeout, but it works! Plus, this way the timeout only starts once all
-                # commands are sent, AND we start watching listening for definitions immediately!
-                wake_up_event = asyncio.Event(loop=loop)
-
-                @asyncio.coroutine
-                def run_stuff_and_timeout(event):
-                    yield from asyncio.gather(*command_futures, loop=loop)
-                    yield from asyncio.sleep(60, loop=loop)
-                    event.set()
-                    yield from _rewake_condition.acquire()
-                    try:
-                        _rewake_condition.notify()
-                    finally:
-                        _rewake_condition.release()
-
-                timeout_future = asyncio.ensure_future(run_stuff_and_timeout(wake_up_event), loop=loop)
-                yield from _rewake_condition.wait_for(lambda: wake_up_event.is_set() or len(_now_initializing) < 20)
-                if len(_now_initializing):
-                    yield from asyncio.sleep(5, loop=loop)
-                timeout_future.cancel()
-            else:
-                _keyword = ''
-                _now_initializing = None
-                _needs_initialization_next = None
-                _rewake_condition = None
-                break
-        finally:
-            _rewake_condition.release()
-
-    # See http://stackoverflow.com/q/41421487/1907543 (PyCharm incorrectly detects this as unreachable due to a while
-    #  loop with the break condition with a try/finally block)
-    # noinspection PyUnreachableCode
-    interface.output_text("Finished loading autocompletion data - saving to .autocomplete_data.json.")
-    to_save = dict(**_autocomplete_definitions)
-    to_save['last_update'] = round(time.time())
+        interface.output_text("Finished loading autocompletion data - saving to {}.".format(CACHE_FILE))
     try:
-        json.dump(to_save, open('.autocomplete_data.json~', mode='w'))
-        os.rename('.autocomplete_data.json~', '.autocomplete_data.json')
+        completion_cache.save(CACHE_FILE, _autocomplete_definitions, round(time.time()))
     except EnvironmentError:
         interface.output_text("Failed to save autocompletion data!")
         interface.output_text(''.join(traceback.format_exc()))
 
 
+def crawl_progress():
+    """
+    :return: (done, pending, failed) for the crawl in progress, or None if there isn't one.
+    :rtype: (int, int, int) | None
+    """
+    scheduler = _fingerprinter or _crawler
+    if scheduler is None:
+        return None
+    return scheduler.progress()
+
+
+def _crawl_progress_text():
+    progress = crawl_progress()
+    if progress is None:
+        return None
+    return '{} done, {} pending, {} failed'.format(*progress)
+
+
+metrics.gauge('autocompletion_crawl', _crawl_progress_text)
+
+
+def is_loading():
+    return bool(_keyword) or bool(_pending_paths)
+
+
 def is_definition(message):
-    return bool(_keyword) and message.lstrip().startswith(_keyword)
+    message = message.lstrip()
+    return (bool(_keyword) and message.startswith(_keyword)
+            or bool(_pending_paths) and message.startswith(_fetch_keyword))
+
+
+def _release_prototypes(names):
+    for name in names:
+        _prototype_references[name] -= 1
+        if _prototype_references[name] <= 0:
+            del _prototype_references[name]
+            _prototype_indexes.pop(name, None)
+
+
+def _store_path(path, own, chain):
+    """
+    :type path: str
+    :type own: list[str]
+    :param chain: (prototype name, members, or None if already known) for each prototype, nearest first.
+    :type chain: list[(str, list[str] | None)]
+    """
+    names = []
+    for name, members in chain:
+        if members is not None:
+            index = _CompletionIndex(members)
+            if not name:
+                # Nothing to share it under, so it's kept only for this path
+                name = '{}#{}'.format(path, len(names))
+            _prototype_indexes[name] = index
+        if name:
+            names.append(name)
+    if path in _deep_paths:
+        _release_prototypes(_deep_paths.pop(path)[1])
+    _prototype_references.update(names)
+    _deep_paths[path] = (_CompletionIndex(own), tuple(names))
+    while len(_deep_paths) > DEEP_CACHE_SIZE:
+        _release_prototypes(_deep_paths.popitem(last=False)[1][1])
+    completions_for.cache_clear()
+
+
+def _load_members(text):
+    path, value = text.split('=', 1)
+    if _pending_paths.pop(path, None) is None:
+        return
+    try:
+        members = json.loads(value)
+        if members is None:
+            own, chain = [], []
+        else:
+            own, chain = members
+            chain = [(name, prototype_members) for name, prototype_members in chain]
+    except ValueError as e:
+        interface.output_text('Failed to decode autocomplete members response! (data: `{}`, error: `{}`)'.format(
+            value, e))
+        return
+    _store_path(path, own, chain)
+
+
+def _fetch_members(path):
+    """
+    Asks the server for a path's members and prototype chain, unless that's already been asked.
+
+    :type path: str
+    """
+    now = time.time()
+    if _fetch_connection is None or now - _pending_paths.get(path, 0) < FETCH_TIMEOUT:
+        return
+    _pending_paths[path] = now
+    metrics.count('completion_fetches')
+    known = sorted(name for name in _prototype_indexes if '#' not in name)
+    asyncio.ensure_future(_fetch_connection.send_command(
+        MEMBERS_COMMAND.format(path=json.dumps(path), known=json.dumps(known), keyword=_fetch_keyword),
+        ratelimit.PRIORITY_COMPLETION
+    ), loop=_fetch_loop)
+
+
+def _deep_completions(parent, text):
+    """
+    :return: Members of `parent` and its prototypes starting with `text`, or None if they haven't been fetched yet.
+    :rtype: list[str] | None
+    """
+    entry = _deep_paths.get(parent)
+    if entry is None:
+        return None
+    index, prototype_names = entry
+    if any(name not in _prototype_indexes for name in prototype_names):
+        # A prototype this was sent without was dropped before the reply came back
+        _release_prototypes(_deep_paths.pop(parent)[1])
+        return None
+    _deep_paths.move_to_end(parent)
+    words = set(index.starting_with(text))
+    for name in prototype_names:
+        words.update(_prototype_indexes[name].starting_with(text))
+    return sorted(words, key=str.casefold)
 
 
 @asyncio.coroutine
@@ -127,17 +342,25 @@ def load_definition(loop, text):
     :type loop: asyncio.events.AbstractEventLoop
     :type text: str
     """
+    text = text.strip()
+    if '\n' in text:
+        for part in text.split('\n'):
+            yield from load_definition(loop, part)
+        return
+    if text.startswith(_fetch_keyword):
+        _load_members(text[len(_fetch_keyword):])
+        return
     if not _keyword:
         return
-    text = text.strip()
     if not text.startswith(_keyword):
         raise ValueError("Invalid text to load")
-    if '\n' in text:
-        for part in text.split('\n'):
-            asyncio.ensure_future(load_definition(loop, part))
+
+    text = text[len(_keyword):]
+    if text.startswith('#'):
+        _load_fingerprint(text[1:])
         return
 
-    name, value = text[len(_keyword):].split('=', 1)
+    name, value = text.split('=', 1)
 
     # TODO: this is completely trusting the server to only send what we expect.
     try:
@@ -146,26 +369,23 @@ def load_definition(loop, text):
         interface.output_text('Failed to decode autocomplete data response! (data: `{}`, error: `{}`)'.format(value, e))
         return
 
-    yield from _rewake_condition.acquire()
-    try:
-        _autocomplete_definitions[name] = completions
-        # TODO: add support for more 'deep' autocomplete through prototype detection
-        # As it stands, we technically _could_ allow for more deep autocomplete with the current setup, but it would
-        # lead to much more data being stored than would be needed, and a lot of unnecessary (and long) command data
-        # transfers.
-        if '.' not in name:
-            if name == 'global':
-                _needs_initialization_next.update(item for item in completions)
-            else:
-                _needs_initialization_next.update('{}.{}'.format(name, item) for item in completions)
-        if name in _now_initializing:
-            _now_initializing.remove(name)
-        _rewake_condition.notify(1)
-    finally:
-        _rewake_condition.release()
+    if _crawler is None:
+        return
+    _set_definition(name, completions)
+    _stale.discard(name)
+    # Only two levels are crawled up front, anything deeper is fetched as it's completed (see _fetch_members).
+    if '.' not in name:
+        if name == 'global':
+            children = completions
+        else:
+            children = ('{}.{}'.format(name, item) for item in completions)
+        _crawler.add(child for child in children if child not in _autocomplete_definitions or child in _stale)
+    _crawler.received(name, len(value))
 
 
-@functools.lru_cache()
+# readline asks for each match in turn with the same text, so keep the last few lists around. Cleared whenever the
+# definitions change.
+@functools.lru_cache(maxsize=64)
 def completions_for(text):
     """
     :param text: The text to complete for.
@@ -173,7 +393,7 @@ def completions_for(text):
     :return: A list of possible completions
     :rtype: list[str]
     """
-    if not _autocomplete_definitions:
+    if not _autocomplete_definitions and not _deep_paths and _fetch_connection is None:
         return []
     if '.' in text:
         parent, text = text.rsplit('.', 1)
@@ -182,8 +402,13 @@ def completions_for(text):
         parent = 'global'
         prefix = ''
 
-    if parent in _autocomplete_definitions:
-        text_match = re.compile(re.escape(text), re.I)
-        return [prefix + word for word in _autocomplete_definitions[parent] if text_match.match(word)]
-    else:
+    index = _index_for(parent)
+    if index is not None:
+        return [prefix + word for word in index.starting_with(text)]
+    if not _path_regex.match(parent):
+        return []
+    words = _deep_completions(parent, text)
+    if words is None:
+        _fetch_members(parent)
         return []
+    return [prefix + word for word in words]
@@ -0,0 +1,271 @@
+"""
+Chunked transfer for results too large to come back as one console message, like `JSON.stringify(Memory)`.
+
+The expression is evaluated once and its result kept in the server's global scope. It's then sent back a window of
+chunks at a time as tagged `console.log` lines, which are written out in order as they arrive, so memory use is bounded
+by the window size no matter how large the result is. Finished results either go to a file, or to a temporary file
+which is shown a page at a time with `:more`.
+"""
+import asyncio
+import json
+import shutil
+import tempfile
+
+from spc import interface, metrics, ratelimit, tagged
+
+CHUNK_SIZE = 1000
+# Chunks requested by each command
+WINDOW_CHUNKS = 20
+# Seconds to wait for the chunks of a window before asking for the missing ones again
+CHUNK_TIMEOUT = 10
+MAX_ATTEMPTS = 3
+PAGE_LINES = 40
+
+# Replies with `<keyword><id>=<chunk count>`, or `<keyword><id>!<error>` if the expression throws.
+START_COMMAND = (
+    '(()=>{{let s;try{{s=(0,eval)({expression})}}catch(e){{return "{keyword}{id}!"+(e&&e.stack||e)}}'
+    's=typeof s=="string"?s:JSON.stringify(s);s=s===undefined?"undefined":s;'
+    'let g=global.__spcChunks=global.__spcChunks||{{}};g[{id}]=s;'
+    'return "{keyword}{id}="+Math.ceil(s.length/{size})}})()'
+)
+# Logs `<keyword><id>:<index>:<chunk>` for each chunk in the range, replying with `<keyword><id>!` if it's gone.
+RANGE_COMMAND = (
+    '(()=>{{let s=(global.__spcChunks||{{}})[{id}];if(s==null)return "{keyword}{id}!";'
+    'for(let i of {indexes})console.log("{keyword}{id}:"+i+":"+s.substr(i*{size},{size}));'
+    'return "{keyword}{id}>"}})()'
+)
+# Replies with `<keyword><id>.`
+FINISH_COMMAND = 'delete (global.__spcChunks||{{}})[{id}],"{keyword}{id}."'
+
+_keyword = tagged.new_keyword('__ch_')
+_transfers = {}
+# Transfers which have finished, but whose FINISH_COMMAND hasn't been answered yet
+_finishing = set()
+_next_id = 0
+# File being shown by :more, if any
+_pager_file = None
+
+
+class ChunkedTransfer:
+    """
+    :type _loop: asyncio.events.AbstractEventLoop
+    :type _connection: spc.communication.ActiveConnection
+    :type _received: dict[int, str]
+    """
+
+    def __init__(self, loop, connection, transfer_id, expression, path=None):
+        """
+        :param path: File to write the result to, or None to page it in the terminal.
+        """
+        self._loop = loop
+        self._connection = connection
+        self.id = transfer_id
+        self.expression = expression
+        self.path = path
+        self._file = open(path, 'w') if path is not None else tempfile.TemporaryFile('w+')
+        self._count = None
+        self._next = 0
+        self._received = {}
+        self._window_end = 0
+        self._attempts = 0
+        self._timeout_handle = None
+        # Number of commands sent with _send_timed, so only the latest one starts a timeout
+        self._sends = 0
+        self.size = 0
+
+    def _send(self, command, priority=ratelimit.PRIORITY_INTERACTIVE):
+        asyncio.ensure_future(self._connection.send_command(command, priority), loop=self._loop)
+
+    def _cancel_timeout(self):
+        if self._timeout_handle is not None:
+            self._timeout_handle.cancel()
+            self._timeout_handle = None
+
+    def _send_timed(self, command):
+        """
+        Sends a command whose reply is waited for, timing out CHUNK_TIMEOUT seconds after it's sent.
+        """
+        self._cancel_timeout()
+        self._sends += 1
+        asyncio.ensure_future(self._send_then_time_out(command, self._sends), loop=self._loop)
+
+    @asyncio.coroutine
+    def _send_then_time_out(self, command, send):
+        yield from self._connection.send_command(command, ratelimit.PRIORITY_INTERACTIVE)
+        # The timeout only starts once the command is sent, since sending may wait on the rate limit. It's skipped if
+        # another command was sent since, or the transfer finished, while this one was waiting.
+        if send == self._sends and _transfers.get(self.id) is self:
+            self._timeout_handle = self._loop.call_later(CHUNK_TIMEOUT, self._timed_out)
+
+    def start(self):
+        self._send_timed(START_COMMAND.format(expression=json.dumps(self.expression), id=self.id, keyword=_keyword,
+                                             size=CHUNK_SIZE))
+
+    def _request(self, indexes):
+        self._send_timed(RANGE_COMMAND.format(indexes=json.dumps(indexes), id=self.id, keyword=_keyword,
+                                              size=CHUNK_SIZE))
+
+    def _request_window(self):
+        self._window_end = min(self._count, self._next + WINDOW_CHUNKS)
+        self._attempts = 0
+        self._request(list(range(self._next, self._window_end)))
+
+    def _timed_out(self):
+        self._timeout_handle = None
+        self._attempts += 1
+        if self._attempts >= MAX_ATTEMPTS:
+            self._finish("Chunked result {} failed: no reply from the server.".format(self.id))
+        elif self._count is None:
+            self.start()
+        else:
+            self._request([index for index in range(self._next, self._window_end) if index not in self._received])
+
+    def started(self, count):
+        """
+        :param count: Number of chunks in the result.
+        :type count: int
+        """
+        if self._count is not None:
+            return
+        self._count = count
+        if count:
+            self._request_window()
+        else:
+            self._finish()
+
+    def received(self, index, text):
+        """
+        :type index: int
+        :type text: str
+        """
+        if index < self._next or index >= self._window_end:
+            return
+        self._received[index] = text
+        while self._next in self._received:
+            chunk = self._received.pop(self._next)
+            self._file.write(chunk)
+            self.size += len(chunk)
+            self._next += 1
+        metrics.count('chunks_received')
+        if self._next >= self._count:
+            self._finish()
+        elif self._next >= self._window_end:
+            self._request_window()
+
+    def _finish(self, error=None):
+        global _pager_file
+        self._cancel_timeout()
+        _transfers.pop(self.id, None)
+        if self._count is not None:
+            _finishing.add(self.id)
+            self._send(FINISH_COMMAND.format(id=self.id, keyword=_keyword), ratelimit.PRIORITY_BACKGROUND)
+        if error is not None:
+            self._file.close()
+            interface.output_text(error, False)
+        elif self.path is not None:
+            self._file.close()
+            interface.output_text("Wrote {} characters to {}.".format(self.size, self.path), False)
+        else:
+            if _pager_file is not None:
+                _pager_file.close()
+            self._file.seek(0)
+            _pager_file = self._file
+            show_page()
+
+    def failed(self, error):
+        """
+        :param error: The error the expression threw, or '' if the server no longer has the result.
+        """
+        if error:
+            self._finish("Chunked result {} failed: {}".format(self.id, error))
+        else:
+            self._finish("Chunked result {} failed: the server no longer has it.".format(self.id))
+
+
+def start(loop, connection, expression, path=None):
+    """
+    :type loop: asyncio.events.AbstractEventLoop
+    :type connection: spc.communication.ActiveConnection
+    :param expression: JavaScript to evaluate.
+    :param path: File to write the result to, or None to page it in the terminal.
+    :rtype: ChunkedTransfer
+    """
+    global _next_id
+    _next_id += 1
+    transfer = ChunkedTransfer(loop, connection, _next_id, expression, path)
+    _transfers[transfer.id] = transfer
+    transfer.start()
+    return transfer
+
+
+def is_active():
+    return bool(_transfers) or bool(_finishing)
+
+
+def is_chunk(text):
+    return is_active() and text.startswith(_keyword)
+
+
+def load_chunk(text):
+    """
+    Handles any of the tagged lines or results sent back for a transfer.
+
+    :type text: str
+    """
+    split = tagged.split_index(text[len(_keyword):])
+    if split is None:
+        return
+    transfer_id, kind, rest = split
+    if kind == '.':
+        _finishing.discard(transfer_id)
+        return
+    transfer = _transfers.get(transfer_id)
+    if transfer is None:
+        return
+    if kind == '=':
+        transfer.started(int(rest))
+    elif kind == ':':
+        index, _, chunk = rest.partition(':')
+        transfer.received(int(index), chunk)
+    elif kind == '!':
+        transfer.failed(rest)
+
+
+def show_page():
+    """
+    Shows the next page of the last result being paged.
+    """
+    global _pager_file
+    if _pager_file is None:
+        interface.output_text("Nothing to page.", False)
+        return
+    # Paged by characters rather than lines, since a JSON result is often one very long line.
+    size = PAGE_LINES * shutil.get_terminal_size().columns
+    text = _pager_file.read(size)
+    if text:
+        interface.output_text(text.rstrip('\n'), False)
+    if len(text) < size:
+        _pager_file.close()
+        _pager_file = None
+        return
+    interface.output_text("-- :more for the next page --", False)
+
+
+def command(loop, connection, arguments):
+    """
+    Handles the `:dump [>FILE] EXPRESSION` meta-command.
+
+    :type loop: asyncio.events.AbstractEventLoop
+    :type connection: spc.communication.ActiveConnection
+    :type arguments: str
+    """
+    path = None
+    if arguments.startswith('>'):
+        path, _, arguments = arguments[1:].strip().partition(' ')
+    if not arguments.strip():
+        interface.output_text("Usage: :dump [>FILE] EXPRESSION", False)
+        return
+    try:
+        start(loop, connection, arguments.strip(), path)
+    except EnvironmentError as e:
+        interface.output_text("Couldn't open {}: {}".format(path, e), False)
@@ -1,39 +1,102 @@
 import asyncio
+import bisect
+import collections
 import json
+import random
+import time
 
 import colorama
-import functools
+import itertools
 import re
-import requests
-import websockets
 
-from spc import autocompletion, interface
+from spc import api, autocompletion, chunked, dispatch, execute, filters, interface, metrics, ratelimit, resultcache, \
+    scrollback, tagged
 
 DEFAULT_WS_URL = 'wss://screeps.com/socket/websocket'
 DEFAULT_API_URL = 'https://screeps.com/api'
 
+DEFAULT_BATCH_MAX_COMMANDS = 50
+RECONNECT_BACKOFF_BASE = 0.5
+RECONNECT_BACKOFF_MAX = 30
+# Times a command is sent before giving up on it
+MAX_COMMAND_ATTEMPTS = 3
+
+STATE_DISCONNECTED = 'disconnected'
+STATE_CONNECTING = 'connecting'
+STATE_AUTHENTICATING = 'authenticating'
+STATE_READY = 'ready'
+# Logging in failed in a way retrying won't fix, like a wrong password, so the connection was given up on
+STATE_FAILED = 'failed'
+
+# Runs each expression in its own try/catch, replying with `<keyword><index>:<result>` or `<keyword><index>!<error>`.
+BATCH_COMMAND = (
+    '{expressions}.map((x,i)=>{{try{{return "{keyword}"+i+":"+(0,eval)(x)}}'
+    'catch(e){{return "{keyword}"+i+"!"+(e&&e.stack||e)}}}}).join("\\n")'
+)
+
 html_script_regex = re.compile('\s*<script>.*</script>\s*', re.IGNORECASE)
 error_regex = re.compile('error', re.IGNORECASE)
 
 def function():
     pass
 
-def process_received_message(message, source='log'):
+def process_received_message(message, source='log', tag=None, color=None):
+    """
+    :param tag: Which connection the message came from, shown before it if given.
+    :param color: Color for log messages, already chosen by `spc.filters`. If not given, errors are shown in red.
+    """
+    prefix = '[{}] '.format(tag) if tag else ''
     if source == 'log':
         if html_script_regex.match(message):
             return
-        if error_regex.search(message):
-            interface.output_text(message, color=colorama.Fore.RED)
-        else:
-            interface.output_text(message)
+        if color is None:
+            color = colorama.Fore.RED if error_regex.search(message) else colorama.Fore.RESET
+        scrollback.record(scrollback.CHANNEL_LOG, prefix + message)
+        interface.output_text(prefix + message, color=color)
     elif source == 'results':
         if html_script_regex.match(message):
             return
-        interface.output_text(message, date=False)
+        scrollback.record(scrollback.CHANNEL_RESULTS, prefix + message)
+        interface.output_text(prefix + message, date=False)
     elif source == 'error':
-        interface.output_text('[error!] ' + message, color=colorama.Fore.RED)
+        scrollback.record(scrollback.CHANNEL_ERROR, prefix + '[error!] ' + message)
+        interface.output_text(prefix + '[error!] ' + message, color=colorama.Fore.RED)
     elif source != 'shard':
-        interface.output_text("[unknown type! {}]".format(source, message), color=colorama.Fore.RED)
+        interface.output_text(prefix + "[unknown type! {}]".format(source, message), color=colorama.Fore.RED)
+
+
+def process_received_messages(messages, source='log', tag=None):
+    for message in messages:
+        process_received_message(message, source, tag)
+
+
+def process_unknown_message(message, tag=None):
+    interface.output_text("{}Unknown message: {}".format('[{}] '.format(tag) if tag else '', message))
+
+
+def is_temporary_error(status_code):
+    """
+    :return: Whether a request which failed with this HTTP status is worth retrying later.
+    :rtype: bool
+    """
+    return status_code in (408, ratelimit.TOO_MANY_REQUESTS) or status_code >= 500
+
+
+def split_batch_result(text, keyword):
+    """
+    Splits the result of a BATCH_COMMAND back into one result per expression.
+
+    :type text: str
+    :type keyword: str
+    :return: (index, failed, result) for each expression, in order
+    :rtype: list[(int, bool, str)]
+    """
+    markers = list(re.finditer('(?:^|\n){}(\\d+)([:!])'.format(re.escape(keyword)), text))
+    results = []
+    for marker, next_marker in zip(markers, itertools.chain(markers[1:], [None])):
+        end = next_marker.start() if next_marker is not None else len(text)
+        results.append((int(marker.group(1)), marker.group(2) == '!', text[marker.end():end]))
+    return results
 
 
 class ActiveConnection:
@@ -43,158 +106,433 @@ class ActiveConnection:
     :type _password: str
     :type _ws_url: str
     :type _connection: websockets.WebSocketClientProtocol
-    :type _queued_commands: list[str]
+    :type _api: spc.api.ApiClient
+    :type _scheduler: spc.ratelimit.CommandScheduler
+    :type _queued_commands: list[(int, str, int, int)]
+    :type _batch: list[(int, str, int, int)]
+    :type reconnect_times: collections.deque[float]
     """
 
-    def __init__(self, loop, username, password, ws_url=None, api_url=None):
+    def __init__(self, loop, username, password, ws_url=None, api_url=None, http_concurrency=None,
+                 http_timeout=None, batch_window=None, batch_max_commands=None, rate_limit_per_hour=None,
+                 rate_limit_burst=None, shard=None, name=None, api_session=None, cached_expressions=None,
+                 result_cache_ticks=None, result_cache_seconds=None):
+        """
+        :param shard: If given, commands run on this shard and only this shard's console output is shown.
+        :param name: Name used to refer to this connection when there are several, defaults to `username/shard`.
+        :param api_session: Session shared with other connections, see `spc.api.SharedSession`.
+        :param batch_window: If set, commands sent within this many seconds of each other are combined into one API
+                             call, and their results split apart again when they come back.
+        :param batch_max_commands: Maximum number of commands combined into one API call.
+        :param rate_limit_per_hour: Console commands allowed per hour by the server.
+        :param rate_limit_burst: Console commands which can be sent at once before being limited to the hourly rate.
+        :param cached_expressions: Regexes for expressions whose results are always cached, see `spc.resultcache`.
+        :param result_cache_ticks: Ticks a cached result is reused for.
+        :param result_cache_seconds: Seconds a cached result is reused for at most.
+        """
         self._loop = loop
         self._username = username
         self._password = password
         self._ws_url = ws_url or DEFAULT_WS_URL
         self._api_url = api_url or DEFAULT_API_URL
+        self.shard = shard
+        self.name = name or ('{}/{}'.format(username, shard) if shard else username)
+        # Shown before all output from this connection, set when there's more than one connection.
+        self.tag = None
+        # If set, called with (connection, texts, type, channel, shard) for received messages instead of showing them.
+        self.message_handler = None
+        self._api = api.ApiClient(loop, self._api_url, http_concurrency, http_timeout, api_session)
+        self._scheduler = ratelimit.CommandScheduler(loop, rate_limit_per_hour, rate_limit_burst)
+        self._result_cache = resultcache.ResultCache(cached_expressions, result_cache_ticks, result_cache_seconds)
         self._connection = None
         self._user_id = None
         self._token = None
-        self._queued_commands = None
+        self._queued_commands = []
+        # Resolved with whether each command was sent, by sequence number
+        self._sent_futures = {}
+        self._sequence = itertools.count()
+        self._state = STATE_DISCONNECTED
         self._ready = False
         self._done = False
-        pass
+        self._reconnecting = False
+        self._replaying = False
+        self._disconnected_at = None
+        self.reconnect_times = collections.deque(maxlen=100)
+        self._batch_window = batch_window
+        self._batch_max_commands = batch_max_commands or DEFAULT_BATCH_MAX_COMMANDS
+        self._batch_keyword = tagged.new_keyword('__b_')
+        self._batch = None
+        self._batch_future = None
+        self._batch_handle = None
+        self._resend_handle = None
+        self._dispatcher = dispatch.MessageDispatcher(self._process_other, self._process_unknown, shard)
+        self._dispatcher.register('messages', 'log', self._process_log)
+        self._dispatcher.register('messages', 'results', self._process_results)
+
+    def _reconnect_delay(self, attempt):
+        # "Full jitter" exponential backoff: the first attempt is immediate.
+        if attempt == 0:
+            return 0
+        return random.uniform(0, min(RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF_BASE * 2 ** attempt))
 
     @asyncio.coroutine
     def connect(self):
-        retry = 3
-        while retry > 0 and not self._done:
+        """
+        Connects and authenticates, retrying with backoff until it succeeds or the connection is closed. A cached
+        token is tried before logging in again.
+
+        :raises spc.api.ApiError: If logging in is refused for a reason retrying won't fix.
+        :raises ValueError: If logging in returns a non-OK result.
+        """
+        # Imported here since it's slow to import, and not needed until after the prompt is shown.
+        import websockets
+        attempt = 0
+        while not self._done:
+            delay = self._reconnect_delay(attempt)
+            if delay:
+                self._status("Failed to connect, retrying in {:.1f}s.".format(delay))
+                yield from asyncio.sleep(delay, loop=self._loop)
+            attempt += 1
+            self._state = STATE_CONNECTING
             try:
                 self._connection = yield from websockets.connect(self._ws_url, loop=self._loop)
-            except websockets.exceptions.InvalidHandshake:
-                pass
-            else:
+                if self._token is None or self._user_id is None:
+                    yield from self._login()
+            except (websockets.exceptions.InvalidHandshake, ConnectionError, OSError) as e:
                 if self._connection is not None:
-                    break
-
-            interface.output_text("Failed to connect, retrying.", False)
-            retry -= 1
-            yield from asyncio.sleep(3, loop=self._loop)
+                    yield from self.close(True)
+                self._status("Failed to connect: {}".format(e))
+            except api.ApiError as e:
+                yield from self.close(True)
+                if not is_temporary_error(e.response.status_code):
+                    raise
+                self._status("Failed to connect: {}".format(e))
+            except ValueError:
+                yield from self.close(True)
+                raise
+            else:
+                break
 
         if self._done:
             if self._connection is not None:
                 yield from self.close(True)
             return
 
-        if self._token is None:
-            yield from self._login()
-
+        self._state = STATE_AUTHENTICATING
         yield from self._connection.send('auth {}'.format(self._token))
         asyncio.ensure_future(self.recv_loop(), loop=self._loop)
 
+    def _schedule_reconnect(self):
+        if self._reconnecting or self._done:
+            return
+        self._reconnecting = True
+        self._ready = False
+        self._state = STATE_DISCONNECTED
+        if self._disconnected_at is None:
+            self._disconnected_at = self._loop.time()
+
+        @asyncio.coroutine
+        def reconnect():
+            try:
+                yield from self.close(True)
+                yield from self.connect()
+            except (api.ApiError, ValueError) as e:
+                self._give_up(e)
+            finally:
+                self._reconnecting = False
+
+        asyncio.ensure_future(reconnect(), loop=self._loop)
+
+    def _give_up(self, error):
+        """
+        Stops reconnecting after logging in failed for good, dropping anything still queued.
+        """
+        self._done = True
+        self._ready = False
+        self._state = STATE_FAILED
+        dropped = len(self._queued_commands)
+        self._finish_commands(self._queued_commands, False)
+        self._queued_commands = []
+        self._status("Failed to log in, giving up on this connection: {}{}".format(
+            error, " ({} queued commands dropped)".format(dropped) if dropped else ''))
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def username(self):
+        return self._username
+
+    def pending_commands(self):
+        """
+        :return: Commands waiting to be sent, either for the rate limit or for the connection to be ready
+        :rtype: int
+        """
+        return self._scheduler.queued() + len(self._queued_commands)
+
     @asyncio.coroutine
     def recv_loop(self):
+        import websockets
+        connection = self._connection
         while True:
             try:
-                message = yield from self._connection.recv()
-            except (websockets.exceptions.InvalidState, ConnectionError):
+                message = yield from connection.recv()
+            except (websockets.exceptions.InvalidState, websockets.exceptions.ConnectionClosed, ConnectionError):
                 if self._done:
-                    interface.output_text("Connection closed.", False)
-                else:
-                    interface.output_text("Reconnecting.", False)
-
-                    @asyncio.coroutine
-                    def reconnect():
-                        yield from self.close(True)
-                        yield from asyncio.sleep(3, loop=self._loop)
-                        yield from self.connect()
-
-                    asyncio.ensure_future(reconnect(), loop=self._loop)
+                    self._status("Connection closed.")
+                elif connection is self._connection:
+                    # Otherwise, this connection was closed on purpose and replaced already.
+                    self._status("Reconnecting.")
+                    self._schedule_reconnect()
                 break
             if message.startswith('auth ok'):
                 self._token = message[len('auth ok '):]
-                yield from self._connection.send('subscribe user:{}/console'.format(self._user_id))
-                interface.output_text("Connected.", False)
+                asyncio.ensure_future(connection.send('subscribe user:{}/console'.format(self._user_id)),
+                                      loop=self._loop)
+                self._state = STATE_READY
                 self._ready = True
+                if self._disconnected_at is not None:
+                    elapsed = self._loop.time() - self._disconnected_at
+                    self._disconnected_at = None
+                    self.reconnect_times.append(elapsed)
+                    metrics.observe('reconnect', elapsed)
+                    self._status("Reconnected in {:.2f}s.".format(elapsed))
+                else:
+                    self._status("Connected.")
                 asyncio.ensure_future(self._send_queued_commands(), loop=self._loop)
                 continue
             elif message.startswith('auth failed'):
-                print("authentication failed.")
-                self._ready = False
+                # The cached token expired: log in from scratch, outside of this loop.
+                self._status("Authentication failed, logging in again.")
                 self._token = None
-                yield from self._connection.close()
-                yield from self._login()
-                yield from self.connect()
+                self._schedule_reconnect()
+                return
+            else:
+                if message.startswith('time '):
+                    self._result_cache.set_time(message[len('time '):])
+                start = time.perf_counter()
+                self._dispatcher.dispatch(message)
+                metrics.observe('frame_dispatch', time.perf_counter() - start)
+                metrics.count('frames')
+
+    def _status(self, text):
+        interface.output_text('[{}] {}'.format(self.tag, text) if self.tag else text, False)
+
+    def _frame_tag(self):
+        if self.tag and self.shard is None and self._dispatcher.current_shard:
+            return '{}/{}'.format(self.tag, self._dispatcher.current_shard)
+        return self.tag
+
+    def _output_messages(self, texts, source):
+        metrics.count('messages', len(texts))
+        if source == 'log':
+            lines = filters.filter_lines(texts)
+            texts = [text for text, color in lines]
+            if not texts:
                 return
+        if self.message_handler is not None:
+            self.message_handler(self, texts, source, self._dispatcher.current_channel, self._dispatcher.current_shard)
+        elif source == 'log':
+            tag = self._frame_tag()
+            for text, color in lines:
+                process_received_message(text, source, tag, color or colorama.Fore.RESET)
+        else:
+            process_received_messages(texts, source, self._frame_tag())
+
+    def _process_log(self, texts):
+        if chunked.is_active():
+            texts = self._take_chunks(texts)
+        if texts:
+            self._output_messages(texts, 'log')
+
+    def _take_chunks(self, texts):
+        remaining = []
+        for text in texts:
+            if chunked.is_chunk(text):
+                chunked.load_chunk(text)
+            else:
+                remaining.append(text)
+        return remaining
+
+    def _process_other(self, texts, source):
+        self._output_messages(texts, source)
+
+    def _process_unknown(self, message):
+        process_unknown_message(message, self.tag)
+
+    def _process_results(self, texts):
+        if self._batch_window and any(text.startswith(self._batch_keyword) for text in texts):
+            texts = self._split_batch_results(texts)
+        if self._result_cache.is_active():
+            texts = self._take_cached_results(texts)
+        if autocompletion.is_loading():
+            results = []
+            for text in texts:
+                if autocompletion.is_definition(text):
+                    asyncio.ensure_future(autocompletion.load_definition(self._loop, text), loop=self._loop)
+                else:
+                    results.append(text)
+            texts = results
+        if chunked.is_active():
+            texts = self._take_chunks(texts)
+        if execute.is_active():
+            results = []
+            for text in texts:
+                if execute.is_result(text):
+                    execute.load_result(text)
+                else:
+                    results.append(text)
+            texts = results
+        if texts:
+            self._output_messages(texts, 'results')
+
+    def _take_cached_results(self, texts):
+        remaining = []
+        for text in texts:
+            if not self._result_cache.is_result(text):
+                remaining.append(text)
+                continue
+            received = self._result_cache.received(text)
+            if received is None:
+                continue
+            succeeded, result, waiters = received
+            if succeeded:
+                # Once for each time it was asked for
+                remaining.extend([result] * waiters)
             else:
-                try:
-                    message_json = json.loads(message)
-                except ValueError:
-                    if not isinstance(message, str) or (not message.startswith('time ')
-                                                        and not message.startswith('protocol ')
-                                                        and not message.startswith('package ')):
-                        interface.output_text("Unknown message: {}".format(message))
-                    continue
+                self._output_messages([result], 'error')
+        return remaining
+
+    def _split_batch_results(self, texts):
+        split = []
+        for text in texts:
+            if not text.startswith(self._batch_keyword):
+                split.append(text)
+                continue
+            for _, failed, result in split_batch_result(text, self._batch_keyword):
+                if failed:
+                    self._output_messages([result], 'error')
                 else:
-                    if len(message_json) != 2:
-                        interface.output_text("Unknown message: {}".format(message))
-                    else:
-                        # TODO: abstract out this monstrosity
-                        for general_type, stuff in message_json[1].items():
-                            if isinstance(stuff, str):
-                                process_received_message(stuff, general_type)
-                            elif isinstance(stuff, dict):
-                                for specific_type, text_list in stuff.items():
-                                    if len(text_list):
-                                        if isinstance(text_list, list):
-                                            for text in text_list:
-                                                if general_type == 'messages' \
-                                                        and specific_type == 'results':
-                                                    if autocompletion.is_definition(text):
-                                                        asyncio.ensure_future(
-                                                            autocompletion.load_definition(self._loop, text))
-                                                    else:
-                                                        process_received_message(text, 'results')
-                                                elif general_type == 'messages' and specific_type == 'log':
-                                                    process_received_message(text)
-                                                else:
-                                                    process_received_message(text, specific_type)
-                                        else:
-                                            if isinstance(text_list, str) and general_type == 'messages' \
-                                                    and specific_type == 'results':
-                                                if autocompletion.is_definition(text_list):
-                                                    asyncio.ensure_future(
-                                                        autocompletion.load_definition(self._loop, text_list))
-                                                else:
-                                                    process_received_message(text_list, 'results')
-                                            elif general_type == 'messages' and specific_type == 'log':
-                                                process_received_message(str(text_list))
-                                            else:
-                                                process_received_message(str(text_list), specific_type)
-                            else:
-                                process_received_message(str(stuff), general_type)
+                    split.append(result)
+        return split
+
+    def _queue_command(self, entry):
+        bisect.insort(self._queued_commands, entry)
 
     @asyncio.coroutine
     def _send_queued_commands(self):
-        if self._queued_commands is not None:
-            futures = []
-            for text in self._queued_commands:
-                futures.append(self._send_command_call(text))
-            self._queued_commands = None
-            yield from asyncio.gather(*futures, loop=self._loop)
+        """
+        Replays queued commands one request at a time, waiting for each before sending the next, so the server runs them
+        in the order they were given. Commands sent meanwhile are queued behind them.
+        """
+        if self._replaying:
+            return
+        self._replaying = True
+        try:
+            # Stops if a resend is scheduled after a failure, or the websocket is lost, and carries on from there later.
+            while self._queued_commands and self._ready and self._resend_handle is None:
+                count = self._batch_max_commands if self._batch_window else 1
+                entries = self._queued_commands[:count]
+                del self._queued_commands[:count]
+                yield from self._send_batch(entries)
+        finally:
+            self._replaying = False
+
+    def _add_to_batch(self, entry):
+        if self._batch is None:
+            self._batch = []
+            self._batch_future = asyncio.Future(loop=self._loop)
+            self._batch_handle = self._loop.call_later(self._batch_window, self._flush_batch)
+        self._batch.append(entry)
+        future = self._batch_future
+        if len(self._batch) >= self._batch_max_commands:
+            self._flush_batch()
+        return future
+
+    def _flush_batch(self):
+        batch, future = self._batch, self._batch_future
+        self._batch = self._batch_future = None
+        self._batch_handle.cancel()
+        self._batch_handle = None
+
+        def finished(sent):
+            if not future.done():
+                if sent.exception() is not None:
+                    future.set_exception(sent.exception())
+                else:
+                    future.set_result(None)
+
+        asyncio.ensure_future(self._send_batch(batch), loop=self._loop).add_done_callback(finished)
+
+    @asyncio.coroutine
+    def _send_batch(self, entries):
+        """
+        :param entries: (sequence, text, priority, attempt) for each command
+        :type entries: list[(int, str, int, int)]
+        """
+        priority = min(entry[2] for entry in entries)
+        if len(entries) == 1:
+            text = entries[0][1]
+        else:
+            text = BATCH_COMMAND.format(expressions=json.dumps([entry[1] for entry in entries]),
+                                        keyword=self._batch_keyword)
+        try:
+            sent = yield from self._send_command_call(text, priority, entries)
+        except Exception:
+            self._finish_commands(entries, False)
+            raise
+        # Otherwise, they're queued to be resent.
+        if sent is not None:
+            self._finish_commands(entries, sent)
+
+    def _finish_commands(self, entries, sent):
+        """
+        Lets whatever sent the commands know whether they were sent.
+        """
+        for entry in entries:
+            future = self._sent_futures.pop(entry[0], None)
+            if future is not None and not future.done():
+                future.set_result(sent)
+
+    def _command_failed(self, entries, error):
+        """
+        Queues commands which couldn't be sent to be replayed, in their original order, after a backoff. The websocket
+        is left alone, since it doesn't depend on HTTP requests working.
+        """
+        if not entries or self._done:
+            self._status("Failed to send command: {}".format(error))
+            self._finish_commands(entries or [], False)
+            return
+        attempts = 0
+        for sequence, text, priority, attempt in entries:
+            if attempt + 1 < MAX_COMMAND_ATTEMPTS:
+                self._queue_command((sequence, text, priority, attempt + 1))
+                attempts = max(attempts, attempt + 1)
+            else:
+                self._status("Failed to send command, giving up: {}\n{}".format(error, text))
+                self._finish_commands([(sequence, text, priority, attempt)], False)
+        if attempts and self._resend_handle is None:
+            delay = self._reconnect_delay(attempts)
+            self._status("Failed to send command ({}), resending in {:.1f}s.".format(error, delay))
+            self._resend_handle = self._loop.call_later(delay, self._resend_queued)
+
+    def _resend_queued(self):
+        self._resend_handle = None
+        # Otherwise, they're sent once the websocket is connected again.
+        if self._ready:
+            asyncio.ensure_future(self._send_queued_commands(), loop=self._loop)
 
     @asyncio.coroutine
     def _login(self):
-        login_result = yield from self._loop.run_in_executor(None, functools.partial(
-            requests.post,
-            self._api_url + '/auth/signin',
-            json={'email': self._username, 'password': self._password}
-        ))
+        login_result = yield from self._api.post('/auth/signin',
+                                                 {'email': self._username, 'password': self._password})
         login_result.raise_for_status()
         login_json = login_result.json()
         if not login_json.get('ok') or not login_json.get('token'):
             raise ValueError("Non-OK result from logging in: {}".format(login_json))
         self._token = login_result.json()['token']
-        info_result = yield from self._loop.run_in_executor(None, functools.partial(
-            requests.get,
-            self._api_url + '/auth/me',
-            headers={'X-Username': self._token, 'X-Token': self._token}
-        ))
+        info_result = yield from self._api.get('/auth/me', headers={'X-Username': self._token, 'X-Token': self._token})
         info_result.raise_for_status()
         info_json = info_result.json()
         if not info_json.get('ok') or not info_json.get('_id'):
@@ -204,58 +542,125 @@ class ActiveConnection:
             self._token = info_result.headers['X-Token']
 
     @asyncio.coroutine
-    def send_command(self, text):
+    def send_command(self, text, priority=ratelimit.PRIORITY_INTERACTIVE, cached=False):
+        """
+        :type text: str
+        :param priority: One of the `spc.ratelimit.PRIORITY_*` constants, lower goes first.
+        :param cached: If true, the expression is safe to repeat, so a recent result for it can be shown instead of
+                       sending it again. Expressions matching `cached_expressions` are always treated this way.
+        :return: Whether the command was sent, once it's been sent or has failed for good. Its result comes back
+                 separately, over the websocket.
+        :rtype: bool
+        """
         if self._done:
-            return
-        if not self._ready:
-            if self._queued_commands:
-                self._queued_commands.append(text)
-            else:
-                self._queued_commands = [text]
+            if self._state == STATE_FAILED:
+                self._status("Not sent, this connection failed to log in.")
+            return False
+        if not text.startswith('.') and (cached or self._result_cache.is_cacheable(text)):
+            return (yield from self._send_cached(text, priority))
+        entry = (next(self._sequence), text, priority, 0)
+        if not self._ready or self._replaying or self._queued_commands:
+            sent = self._sent_futures[entry[0]] = asyncio.Future(loop=self._loop)
+            # Behind anything already waiting, to keep the order
+            self._queue_command(entry)
+            if self._ready and not self._replaying and self._resend_handle is None:
+                yield from self._send_queued_commands()
+            return (yield from sent)
+        elif text.startswith('.'):
+            self._connection.send(text[1:])
+            return True
+        sent = self._sent_futures[entry[0]] = asyncio.Future(loop=self._loop)
+        if self._batch_window:
+            yield from self._add_to_batch(entry)
         else:
-            if text.startswith('.'):
-                self._connection.send(text[1:])
-            else:
-                yield from self._send_command_call(text)
+            yield from self._send_batch([entry])
+        return (yield from sent)
 
     @asyncio.coroutine
-    def _send_command_call(self, text, retry=3):
+    def _send_cached(self, text, priority):
+        result = self._result_cache.get(text)
+        if result is not None:
+            metrics.count('result_cache_hits')
+            self._output_messages([result], 'results')
+            return True
+        command = self._result_cache.request(text)
+        if command is None:
+            metrics.count('result_cache_merged')
+            return True
+        metrics.count('result_cache_misses')
+        sent = yield from self.send_command(command, priority)
+        if not sent:
+            self._result_cache.failed(text)
+        return sent
+
+    def _console_body(self, text):
+        if self.shard is not None:
+            return {'expression': text, 'shard': self.shard}
+        return {'expression': text}
+
+    @asyncio.coroutine
+    def _send_command_call(self, text, priority=ratelimit.PRIORITY_INTERACTIVE, entries=None, retry=3):
+        """
+        :param entries: The queued commands `text` was made from, resent later if this fails to send.
+        :return: Whether it was sent, or None if it's been queued to be resent.
+        :rtype: bool | None
+        """
+        start = time.perf_counter()
         try:
-            result = yield from self._loop.run_in_executor(None, functools.partial(
-                requests.post,
-                self._api_url + '/user/console',
-                headers={'X-Username': self._token, 'X-Token': self._token},
-                json={'expression': text}
-            ))
+            result = yield from self._scheduler.submit(
+                lambda: self._api.post('/user/console', self._console_body(text),
+                                       headers={'X-Username': self._token, 'X-Token': self._token}),
+                priority
+            )
+        except api.ApiNoResponseError as e:
+            # It might have run already, so sending it again could run it twice.
+            metrics.count('command_failures')
+            self._status("No response to command, it may or may not have run: {}\n{}".format(e, text))
+            return False
         except ConnectionError as e:
-            interface.output_text("Failed to send command: {}".format(
-                e), False)
-            return
+            metrics.count('command_failures')
+            self._command_failed(entries, e)
+            return None
+        metrics.observe('command_send', time.perf_counter() - start)
+        metrics.count('commands')
         if not result.ok:
-            result_json = result.json()
+            try:
+                result_json = result.json()
+            except ValueError:
+                result_json = None
             if result_json and result_json.get('error') == 'unauthorized' and retry > 0:
                 yield from self._login()
-                return (yield from self._send_command_call(text, retry=retry - 1))
-            interface.output_text("Failed to send command: HTTP Error {}: {}:\n{}".format(
-                result.status_code, result.reason, result.text), False)
-            return
+                return (yield from self._send_command_call(text, priority, entries, retry=retry - 1))
+            self._status("Failed to send command: HTTP Error {}: {}:\n{}".format(
+                result.status_code, result.reason, result.text))
+            return False
         result_json = result.json()
         if 'X-Token' in result.headers and len(result.headers['X-Token']) > 0:
             self._token = result.headers['X-Token']
         if not result_json.get('ok'):
             if result_json.get('error') == 'unauthorized' and retry > 0:
                 yield from self._login()
-                yield from self._send_command_call(text, retry=retry - 1)
-            interface.output_text("Failed to send command: non-OK result:\n{}".format(
-                result_json), False)
+                return (yield from self._send_command_call(text, priority, entries, retry=retry - 1))
+            self._status("Failed to send command: non-OK result:\n{}".format(
+                result_json))
+            return False
+        return True
 
     @asyncio.coroutine
     def close(self, reconnecting_already=False):
         if not reconnecting_already:
             self._done = True
+            self._state = STATE_DISCONNECTED
+            if self._resend_handle is not None:
+                self._resend_handle.cancel()
+                self._resend_handle = None
+            self._finish_commands(self._queued_commands, False)
         if self._connection:
             try:
                 yield from self._connection.close()
             except ConnectionError:
                 pass
             self._connection = None
+        if not reconnecting_already:
+            yield from self._scheduler.close()
+            yield from self._api.close()
@@ -0,0 +1,191 @@
+"""
+Compact on-disk format for autocompletion definitions.
+
+Every distinct string (parent names and member names alike) is stored once in a string table, and each parent stores
+its members as indexes into that table. The file is memory mapped and nothing is decoded up front: a parent's member
+list is only decoded the first time it's asked for, so loading costs the same no matter how much has been crawled.
+
+Layout (all integers little-endian):
+
+    header         see HEADER below
+    string index   string_count * u32, end offset of each string in the string blob
+    parent table   parent_count * (u32 name string, u32 first member, u32 member count), sorted by name
+    member ids     u32 string index for every member of every parent
+    string blob    utf-8 strings, back to back
+"""
+import collections.abc
+import mmap
+import os
+import struct
+
+FORMAT_MAGIC = b'SPCA'
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<4sHHQIIIIII')
+U32 = struct.Struct('<I')
+PARENT_ENTRY = struct.Struct('<III')
+
+
+class LazyDefinitions(collections.abc.Mapping):
+    """
+    Read-only view of a definitions file, with an in-memory overlay for anything set after loading.
+
+    :type last_update: int
+    """
+
+    def __init__(self, file, data, last_update, string_count, parent_count, string_index_at, parent_table_at,
+                 member_ids_at, blob_at):
+        self._file = file
+        self._data = data
+        self.last_update = last_update
+        self._string_count = string_count
+        self._parent_count = parent_count
+        self._string_index_at = string_index_at
+        self._parent_table_at = parent_table_at
+        self._member_ids_at = member_ids_at
+        self._blob_at = blob_at
+        self._strings = {}
+        self._decoded = {}
+        self._overlay = {}
+
+    def _string(self, string_id):
+        string = self._strings.get(string_id)
+        if string is None:
+            end, = U32.unpack_from(self._data, self._string_index_at + U32.size * string_id)
+            if string_id:
+                start, = U32.unpack_from(self._data, self._string_index_at + U32.size * (string_id - 1))
+            else:
+                start = 0
+            raw = self._data[self._blob_at + start:self._blob_at + end]
+            string = self._strings[string_id] = raw.decode('utf-8')
+        return string
+
+    def _parent_entry(self, position):
+        return PARENT_ENTRY.unpack_from(self._data, self._parent_table_at + PARENT_ENTRY.size * position)
+
+    def _find_parent(self, name):
+        low, high = 0, self._parent_count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._parent_entry(middle)
+            middle_name = self._string(entry[0])
+            if middle_name < name:
+                low = middle + 1
+            elif middle_name > name:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def __getitem__(self, name):
+        if name in self._overlay:
+            return self._overlay[name]
+        members = self._decoded.get(name)
+        if members is None:
+            entry = self._find_parent(name)
+            if entry is None:
+                raise KeyError(name)
+            _, first_member, member_count = entry
+            member_ids = struct.unpack_from('<{}I'.format(member_count), self._data,
+                                            self._member_ids_at + U32.size * first_member)
+            members = self._decoded[name] = [self._string(member_id) for member_id in member_ids]
+        return members
+
+    def __setitem__(self, name, members):
+        self._overlay[name] = members
+
+    def __contains__(self, name):
+        return name in self._overlay or self._find_parent(name) is not None
+
+    def __iter__(self):
+        for position in range(self._parent_count):
+            name = self._string(self._parent_entry(position)[0])
+            if name not in self._overlay:
+                yield name
+        yield from self._overlay
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __bool__(self):
+        return self._parent_count > 0 or bool(self._overlay)
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+
+def load(path):
+    """
+    :type path: str
+    :return: The definitions stored at `path`, or None if there are none or they're in an old format.
+    :rtype: LazyDefinitions | None
+    """
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    try:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty file
+        file.close()
+        return None
+    if len(data) < HEADER.size:
+        data.close()
+        file.close()
+        return None
+    magic, version, _, last_update, *counts_and_offsets = HEADER.unpack_from(data)
+    if magic != FORMAT_MAGIC or version != FORMAT_VERSION:
+        data.close()
+        file.close()
+        return None
+    return LazyDefinitions(file, data, last_update, *counts_and_offsets)
+
+
+def save(path, definitions, last_update):
+    """
+    Writes definitions to `path`, replacing any existing file only once the new one is complete.
+
+    :type path: str
+    :type definitions: dict[str, list[str]]
+    :type last_update: int
+    """
+    string_ids = {}
+    strings = []
+
+    def string_id(string):
+        existing = string_ids.get(string)
+        if existing is None:
+            existing = string_ids[string] = len(strings)
+            strings.append(string.encode('utf-8'))
+        return existing
+
+    parent_entries = []
+    member_ids = []
+    for name in sorted(definitions):
+        members = definitions[name]
+        parent_entries.append((string_id(name), len(member_ids), len(members)))
+        member_ids.extend(string_id(str(member)) for member in members)
+
+    string_ends = []
+    end = 0
+    for string in strings:
+        end += len(string)
+        string_ends.append(end)
+
+    string_index_at = HEADER.size
+    parent_table_at = string_index_at + U32.size * len(strings)
+    member_ids_at = parent_table_at + PARENT_ENTRY.size * len(parent_entries)
+    blob_at = member_ids_at + U32.size * len(member_ids)
+
+    temp_path = path + '~'
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, 0, last_update, len(strings), len(parent_entries),
+                               string_index_at, parent_table_at, member_ids_at, blob_at))
+        file.write(struct.pack('<{}I'.format(len(string_ends)), *string_ends))
+        for entry in parent_entries:
+            file.write(PARENT_ENTRY.pack(*entry))
+        file.write(struct.pack('<{}I'.format(len(member_ids)), *member_ids))
+        file.write(b''.join(strings))
+    os.replace(temp_path, path)
@@ -0,0 +1,165 @@
+import asyncio
+import collections
+
+import itertools
+
+
+class CrawlScheduler:
+    """
+    Work queue for requesting data about many names through console commands, where the answers come back
+    asynchronously, one per name, through the websocket.
+
+    Names are sent in chunks with at most `max_in_flight` chunks outstanding. Each chunk has a deadline, and when it
+    passes only the names in that chunk which haven't been answered yet are queued again, up to `max_attempts` times.
+    Chunk size follows the average answer size so that one chunk's answers stay under `max_response_size`, and is
+    halved whenever a chunk times out without any answers at all. Each fully answered chunk grows it by one again.
+
+    :type _loop: asyncio.events.AbstractEventLoop
+    :type _send_chunk: (list[str]) -> asyncio.Future
+    :type _queue: collections.deque[str]
+    :type _in_flight: dict[int, set[str]]
+    :type _deadlines: dict[int, float]
+    :type _sizes: dict[int, int]
+    :type _request_of: dict[str, int]
+    :type _attempts: dict[str, int]
+    """
+
+    def __init__(self, loop, send_chunk, max_in_flight=5, chunk_size=20, max_chunk_size=100, timeout=30,
+                 max_attempts=3, max_response_size=32 * 1024):
+        """
+        :param send_chunk: Coroutine function sending the command requesting the given names.
+        """
+        self._loop = loop
+        self._send_chunk = send_chunk
+        self._max_in_flight = max_in_flight
+        self._chunk_size = chunk_size
+        self._max_chunk_size = max_chunk_size
+        self._timeout = timeout
+        self._max_attempts = max_attempts
+        self._max_response_size = max_response_size
+        self._queue = collections.deque()
+        self._seen = set()
+        self._in_flight = {}
+        self._deadlines = {}
+        self._sizes = {}
+        self._request_of = {}
+        self._attempts = {}
+        self._request_ids = itertools.count()
+        self._wakeup = asyncio.Event(loop=loop)
+        self._response_bytes = 0
+        self._response_count = 0
+        self.done = 0
+        self.failed = set()
+
+    def add(self, names):
+        """
+        Queues names which haven't been queued before.
+
+        :type names: collections.Iterable[str]
+        """
+        for name in names:
+            if name not in self._seen:
+                self._seen.add(name)
+                self._queue.append(name)
+        self._wakeup.set()
+
+    def received(self, name, size=0):
+        """
+        Marks a name as answered.
+
+        :type name: str
+        :param size: Size of the answer, used to pick chunk sizes.
+        """
+        request_id = self._request_of.pop(name, None)
+        if request_id is None:
+            return
+        self.done += 1
+        self._response_bytes += size
+        self._response_count += 1
+        remaining = self._in_flight[request_id]
+        remaining.discard(name)
+        if not remaining:
+            del self._in_flight[request_id]
+            del self._deadlines[request_id]
+            del self._sizes[request_id]
+            self._chunk_size = min(self._max_chunk_size, self._chunk_size + 1)
+        self._wakeup.set()
+
+    def is_pending(self, name):
+        return name in self._request_of
+
+    @property
+    def pending(self):
+        return len(self._queue) + len(self._request_of)
+
+    def progress(self):
+        """
+        :rtype: (int, int, int)
+        :return: (done, pending, failed)
+        """
+        return self.done, self.pending, len(self.failed)
+
+    def _next_chunk_size(self):
+        if self._response_count:
+            average = self._response_bytes / self._response_count
+            fitting = int(self._max_response_size // max(average, 1))
+            return max(1, min(self._chunk_size, fitting))
+        return self._chunk_size
+
+    def _dispatch(self):
+        while self._queue and len(self._in_flight) < self._max_in_flight:
+            chunk = [self._queue.popleft() for _ in range(min(self._next_chunk_size(), len(self._queue)))]
+            request_id = next(self._request_ids)
+            self._in_flight[request_id] = set(chunk)
+            self._sizes[request_id] = len(chunk)
+            # The deadline only starts once the command is sent, since sending may wait on the rate limit.
+            self._deadlines[request_id] = float('inf')
+            for name in chunk:
+                self._request_of[name] = request_id
+                self._attempts[name] = self._attempts.get(name, 0) + 1
+            asyncio.ensure_future(self._send(request_id, chunk), loop=self._loop)
+
+    @asyncio.coroutine
+    def _send(self, request_id, chunk):
+        try:
+            yield from self._send_chunk(chunk)
+        finally:
+            if request_id in self._deadlines:
+                self._deadlines[request_id] = self._loop.time() + self._timeout
+                self._wakeup.set()
+
+    def _expire(self):
+        now = self._loop.time()
+        for request_id, deadline in list(self._deadlines.items()):
+            if deadline > now:
+                continue
+            remaining = self._in_flight.pop(request_id)
+            del self._deadlines[request_id]
+            if len(remaining) == self._sizes.pop(request_id):
+                # Nothing came back at all, most likely because the answer was too large.
+                self._chunk_size = max(1, self._chunk_size // 2)
+            for name in remaining:
+                del self._request_of[name]
+                if self._attempts[name] >= self._max_attempts:
+                    self.failed.add(name)
+                else:
+                    self._queue.append(name)
+
+    @asyncio.coroutine
+    def run(self):
+        """
+        Sends everything queued, and anything added while running, returning as soon as the last name is answered or
+        has failed.
+        """
+        while True:
+            self._expire()
+            self._dispatch()
+            if not self._queue and not self._in_flight:
+                return
+            self._wakeup.clear()
+            next_deadline = min(self._deadlines.values(), default=float('inf'))
+            timeout = max(0, next_deadline - self._loop.time()) if next_deadline != float('inf') else None
+            try:
+                yield from asyncio.wait_for(self._wakeup.wait(), timeout, loop=self._loop)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,89 @@
+import json
+
+# Plain-text frames the server sends which we have no use for.
+IGNORED_PREFIXES = ('time ', 'protocol ', 'package ')
+
+
+class MessageDispatcher:
+    """
+    Routes websocket frames to handlers registered by `(general_type, specific_type)`.
+
+    A frame looks like `["user:<id>/console", {"messages": {"log": [...], "results": [...]}, "shard": "shard0"}]`.
+    For `"messages"` above, the general type is `messages` and the specific types are `log` and `results`. Top-level
+    values which aren't dicts (like `"shard"`) are dispatched with a specific type of `None`.
+
+    Handlers are called once per list of texts, never once per text. While they run, `current_channel` is the frame's
+    channel (`"user:<id>/console"` above) and `current_shard` is its `"shard"` value, if it had one.
+
+    :type current_channel: str | None
+    :type current_shard: str | None
+    :type _handlers: dict[(str, str | None), (list[str]) -> None]
+    :type _fallback: (list[str], str) -> None
+    :type _unknown: (str) -> None
+    """
+
+    def __init__(self, fallback, unknown, shard=None):
+        """
+        :param fallback: Called with `(texts, type)` for unregistered types, where type is the specific type if there
+                         is one, otherwise the general type.
+        :param unknown: Called with the raw frame for frames which can't be understood.
+        :param shard: If given, frames from other shards are ignored.
+        """
+        self._handlers = {}
+        self._fallback = fallback
+        self._unknown = unknown
+        self._shard = shard
+        self.current_channel = None
+        self.current_shard = None
+
+    def register(self, general_type, specific_type, handler):
+        """
+        :type general_type: str
+        :type specific_type: str | None
+        :type handler: (list[str]) -> None
+        """
+        self._handlers[(general_type, specific_type)] = handler
+
+    def _dispatch(self, general_type, specific_type, texts):
+        handler = self._handlers.get((general_type, specific_type))
+        if handler is not None:
+            handler(texts)
+        else:
+            self._fallback(texts, specific_type or general_type)
+
+    def dispatch(self, message):
+        """
+        Parses and dispatches a single frame.
+
+        :type message: str
+        """
+        if message.startswith(IGNORED_PREFIXES):
+            return
+        try:
+            message_json = json.loads(message)
+        except ValueError:
+            self._unknown(message)
+            return
+        if not isinstance(message_json, list) or len(message_json) != 2 or not isinstance(message_json[1], dict):
+            self._unknown(message)
+            return
+
+        frame_shard = message_json[1].get('shard')
+        if self._shard is not None and frame_shard is not None and frame_shard != self._shard:
+            return
+        self.current_channel = message_json[0]
+        self.current_shard = frame_shard
+        for general_type, stuff in message_json[1].items():
+            if general_type == 'shard':
+                # Already handled above, not a message
+                continue
+            if isinstance(stuff, dict):
+                for specific_type, text_list in stuff.items():
+                    if not text_list:
+                        continue
+                    if isinstance(text_list, list):
+                        self._dispatch(general_type, specific_type, text_list)
+                    else:
+                        self._dispatch(general_type, specific_type, [str(text_list)])
+            else:
+                self._dispatch(general_type, None, [str(stuff)])
@@ -0,0 +1,159 @@
+"""
+Non-interactive execution of a list of console expressions, from a file or piped into stdin.
+
+Several expressions are in flight at once, but results are printed to stdout in the order the expressions were given.
+Each expression's result is tagged with its index, so results are matched up correctly whatever order they arrive in.
+"""
+import asyncio
+import json
+import sys
+import time
+
+from spc import interface, tagged
+
+DEFAULT_CONCURRENCY = 4
+# Seconds to wait for each expression's result
+DEFAULT_TIMEOUT = 60
+EXIT_FAILED = 1
+EXIT_INTERRUPTED = 130
+
+# Replies with `<keyword><index>:<result>` or `<keyword><index>!<error>`.
+EXEC_COMMAND = (
+    '(()=>{{try{{return "{keyword}{index}:"+(0,eval)({expression})}}'
+    'catch(e){{return "{keyword}{index}!"+(e&&e.stack||e)}}}})()'
+)
+
+_active_run = None
+
+
+def read_expressions(file):
+    """
+    Reads one expression per line, skipping blank lines and lines starting with `//`.
+
+    :type file: io.TextIOBase
+    :rtype: list[str]
+    """
+    expressions = []
+    for line in file:
+        line = line.strip()
+        if line and not line.startswith('//'):
+            expressions.append(line)
+    return expressions
+
+
+def is_active():
+    return _active_run is not None
+
+
+def is_result(text):
+    return _active_run is not None and text.startswith(_active_run.keyword)
+
+
+def load_result(text):
+    """
+    :type text: str
+    """
+    if _active_run is not None:
+        _active_run.received(text[len(_active_run.keyword):])
+
+
+class BatchRun:
+    """
+    :type _loop: asyncio.events.AbstractEventLoop
+    :type _connection: spc.communication.ActiveConnection
+    :type _expressions: list[str]
+    :type _results: list[(bool, str, float) | None]
+    :type _waiting: dict[int, asyncio.Future]
+    """
+
+    def __init__(self, loop, connection, expressions, concurrency=None, timeout=None, output=None):
+        """
+        :param concurrency: Expressions sent and waiting for their result at once.
+        :param timeout: Seconds to wait for each result before counting the expression as failed.
+        :param output: Where results are written, defaults to stdout.
+        """
+        self._loop = loop
+        self._connection = connection
+        self._expressions = expressions
+        self._concurrency = concurrency or DEFAULT_CONCURRENCY
+        self._timeout = timeout or DEFAULT_TIMEOUT
+        self._output = output or sys.stdout
+        self.keyword = tagged.new_keyword('__ex_')
+        self._results = [None] * len(expressions)
+        self._waiting = {}
+        self._next_output = 0
+        self.failed = 0
+
+    def received(self, text):
+        """
+        :param text: A tagged result, without the keyword.
+        """
+        split = tagged.split_index(text)
+        if split is None:
+            return
+        index, separator, result = split
+        future = self._waiting.get(index)
+        if future is not None and not future.done():
+            future.set_result((separator == ':', result))
+
+    @asyncio.coroutine
+    def _send_and_wait(self, index, future):
+        sent = yield from self._connection.send_command(EXEC_COMMAND.format(
+            keyword=self.keyword, index=index, expression=json.dumps(self._expressions[index])))
+        if not sent:
+            # Why is shown already, and there's no result coming.
+            return False, "failed to send"
+        return (yield from future)
+
+    @asyncio.coroutine
+    def _run_one(self, index, semaphore):
+        expression = self._expressions[index]
+        with (yield from semaphore):
+            future = self._waiting[index] = asyncio.Future(loop=self._loop)
+            start = time.perf_counter()
+            try:
+                ok, result = yield from asyncio.wait_for(self._send_and_wait(index, future), self._timeout,
+                                                         loop=self._loop)
+            except asyncio.TimeoutError:
+                ok, result = False, "no result after {} seconds".format(self._timeout)
+            finally:
+                del self._waiting[index]
+        latency = time.perf_counter() - start
+        self._results[index] = (ok, result, latency)
+        if not ok:
+            self.failed += 1
+        interface.output_text("[{}/{}] {:.0f}ms {}: {}".format(index + 1, len(self._expressions), latency * 1000,
+                                                              'ok' if ok else 'failed', expression), False)
+        if not ok:
+            interface.output_text(result, False)
+        self._write_ready()
+
+    def _write_ready(self):
+        while self._next_output < len(self._results) and self._results[self._next_output] is not None:
+            ok, result, _ = self._results[self._next_output]
+            if ok:
+                self._output.write(result + '\n')
+            self._results[self._next_output] = (ok, None, self._results[self._next_output][2])
+            self._next_output += 1
+        self._output.flush()
+
+    @asyncio.coroutine
+    def run(self):
+        """
+        :return: Exit code: 0 if every expression succeeded, otherwise EXIT_FAILED.
+        :rtype: int
+        """
+        global _active_run
+        _active_run = self
+        semaphore = asyncio.Semaphore(self._concurrency, loop=self._loop)
+        try:
+            yield from asyncio.gather(*(self._run_one(index, semaphore) for index in range(len(self._expressions))),
+                                      loop=self._loop)
+        finally:
+            _active_run = None
+        latencies = sorted(latency for _, _, latency in self._results)
+        if latencies:
+            interface.output_text("{} expressions, {} failed, latency p50 {:.0f}ms, p99 {:.0f}ms, max {:.0f}ms".format(
+                len(latencies), self.failed, latencies[len(latencies) // 2] * 1000,
+                latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, latencies[-1] * 1000), False)
+        return EXIT_FAILED if self.failed else 0
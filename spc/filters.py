@@ -0,0 +1,380 @@
+"""
+User configurable filtering of console log lines: include and exclude patterns, highlighting and per-pattern rate
+limits.
+
+A literal keyword is taken from each pattern, and all the keywords are combined into one regular expression which finds
+them in a single pass over the line. Only the rules whose keywords were found are then matched, each with its own
+regex, so a rule only costs a regex pass on lines which contain its keyword. Rules without a keyword, like `a|b`, are
+matched against every line. Patterns are case insensitive. Lines which are filtered out are counted against the rule
+which removed them.
+"""
+import re
+import time
+
+import colorama
+
+from spc import interface, metrics
+
+INCLUDE = 'include'
+EXCLUDE = 'exclude'
+HIGHLIGHT = 'highlight'
+LIMIT = 'limit'
+KINDS = (INCLUDE, EXCLUDE, HIGHLIGHT, LIMIT)
+
+DEFAULT_RULES = [(HIGHLIGHT, 'error', 'red')]
+
+_SPECIAL = set('.^$*+?{}[]()\\|')
+# Lengths of escapes like `\x41` which take an argument, none of which is part of a keyword
+_ESCAPE_LENGTHS = {'x': 4, 'u': 6, 'U': 10}
+# Non-ASCII characters a case insensitive regex matches to ASCII letters
+_CASE_FOLDS = str.maketrans({'\u0130': 'i', '\u0131': 'i', '\u017f': 's', '\u212a': 'k'})
+
+
+def _keyword(pattern):
+    """
+    :return: The longest run of literal characters every match of the pattern contains, or '' if there isn't a simple
+             one to find.
+    :rtype: str
+    """
+    if '|' in pattern or re.search(r'\(\?[aiLmsux-]', pattern):
+        # Alternatives, or inline flags like `(?x)` which change what the rest of the pattern means
+        return ''
+    best = ''
+    current = ''
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        start = i
+        char = pattern[i]
+        literal = None
+        if char == '\\' and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            if not escaped.isalnum():
+                literal = escaped
+                i += 2
+            elif escaped == 'N':
+                i = pattern.find('}', i) + 1 or len(pattern)
+            elif escaped.isdigit():
+                # Group references and octal escapes: at most three digits
+                i += 2
+                while i < len(pattern) and i - start < 4 and pattern[i].isdigit():
+                    i += 1
+            else:
+                i += _ESCAPE_LENGTHS.get(escaped, 2)
+        elif char == '[':
+            end = pattern.find(']', i + 2) + 1 or len(pattern)
+            if '\\' in pattern[i:end]:
+                # The class might end at a later `]` than the one found
+                return ''
+            i = end
+        elif char == '{':
+            i = pattern.find('}', i) + 1 or len(pattern)
+        else:
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            elif char not in _SPECIAL and depth == 0:
+                literal = char
+            i += 1
+        # Characters inside groups or followed by an optional quantifier might not be in every match
+        if literal is not None and ord(literal) < 128 and pattern[i:i + 1] not in ('?', '*', '{'):
+            current += literal.lower()
+        else:
+            if len(current) > len(best):
+                best = current
+            current = ''
+    return current if len(current) > len(best) else best
+
+
+class Rule:
+    """
+    :type kind: str
+    :type pattern: str
+    :param keyword: Literal text in every match of the pattern, or '' if there isn't any.
+    :param argument: Color name for highlight rules, lines per second for limit rules.
+    :type suppressed: int
+    """
+
+    def __init__(self, kind, pattern, argument=None):
+        """
+        :raises ValueError: If the rule is invalid.
+        """
+        if kind not in KINDS:
+            raise ValueError("Unknown filter kind {}, expected one of {}".format(kind, ', '.join(KINDS)))
+        try:
+            self.regex = re.compile(pattern, re.IGNORECASE | re.DOTALL)
+        except re.error as e:
+            raise ValueError("Invalid pattern {}: {}".format(pattern, e))
+        self.kind = kind
+        self.pattern = pattern
+        self.keyword = _keyword(pattern)
+        self.argument = argument
+        self.suppressed = 0
+        if kind == HIGHLIGHT:
+            self.color = getattr(colorama.Fore, str(argument).upper(), None)
+            if self.color is None:
+                raise ValueError("Unknown color {}".format(argument))
+        elif kind == LIMIT:
+            self.rate = float(argument)
+            if self.rate <= 0:
+                raise ValueError("Rate limit must be positive")
+            self._tokens = max(self.rate, 1)
+            self._updated = time.monotonic()
+
+    def allow(self):
+        """
+        Uses up one line of this limit rule's allowance.
+
+        :rtype: bool
+        """
+        now = time.monotonic()
+        self._tokens = min(max(self.rate, 1), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def describe(self):
+        if self.kind == HIGHLIGHT:
+            return '{} {} {}'.format(self.kind, self.argument, self.pattern)
+        elif self.kind == LIMIT:
+            return '{} {:g} {}'.format(self.kind, self.rate, self.pattern)
+        return '{} {}'.format(self.kind, self.pattern)
+
+
+_rules = []
+# Finds the rules' keywords in a case folded line, or None if there are no keywords
+_keyword_regex = None
+# Rules to match against a line for each keyword found in it
+_keyword_rules = {}
+# Rules without a keyword, matched against every line
+_unkeyed_rules = []
+_has_includes = False
+# Lines which didn't match any include rule
+_not_included = 0
+
+
+def _keyword_pattern(keywords):
+    """
+    :return: A regex matching any of the keywords, with common prefixes shared so each position of a line is only
+             checked against the keywords which could start there.
+    :rtype: str
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = None
+
+    def build(node):
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ''
+        if len(alternatives) == 1 and '' not in node:
+            return alternatives[0]
+        return '(?:{}){}'.format('|'.join(alternatives), '?' if '' in node else '')
+
+    return build(trie)
+
+
+def _overlap(first, second):
+    """
+    :return: Whether the two keywords can share characters in a line: one is inside the other, or one starts with the
+             end of the other.
+    :rtype: bool
+    """
+    return (first in second or second in first
+            or any(first.endswith(second[:length]) or second.endswith(first[:length])
+                   for length in range(1, min(len(first), len(second)))))
+
+
+def _compile():
+    global _keyword_regex, _keyword_rules, _unkeyed_rules, _has_includes
+    keywords = set(rule.keyword for rule in _rules if rule.keyword)
+    # Keywords found in a line never overlap each other, so one which shares characters with a found keyword might be
+    # in the line too. Matching its rules as well is always safe, since each rule is checked with its own regex.
+    _keyword_rules = {keyword: [rule for rule in _rules if rule.keyword and _overlap(rule.keyword, keyword)]
+                      for keyword in keywords}
+    _unkeyed_rules = [rule for rule in _rules if not rule.keyword]
+    # Matched against case folded lines: a case insensitive regex would check every position against every keyword.
+    _keyword_regex = re.compile(_keyword_pattern(keywords)) if keywords else None
+    _has_includes = any(rule.kind == INCLUDE for rule in _rules)
+
+
+def _fold_case(text):
+    """
+    :return: The text with every character a case insensitive regex matches to an ASCII letter turned into that letter,
+             like `ſ` into `s`. casefold() isn't used since it turns `İ` into two characters.
+    :rtype: str
+    """
+    return text.translate(_CASE_FOLDS).lower()
+
+
+def _matching_rules(text):
+    """
+    :return: The rules matching the text, in order.
+    :rtype: list[Rule]
+    """
+    candidates = _unkeyed_rules
+    if _keyword_regex is not None:
+        found = _keyword_regex.findall(_fold_case(text))
+        if found:
+            candidates = set(candidates)
+            for keyword in found:
+                candidates.update(_keyword_rules[keyword])
+            candidates = [rule for rule in _rules if rule in candidates]
+    return [rule for rule in candidates if rule.regex.search(text)]
+
+
+def add_rule(kind, pattern, argument=None):
+    """
+    :raises ValueError: If the rule is invalid.
+    :rtype: Rule
+    """
+    rule = Rule(kind, pattern, argument)
+    _rules.append(rule)
+    _compile()
+    return rule
+
+
+def remove_rule(index):
+    """
+    :raises IndexError: If there's no rule with that index.
+    """
+    del _rules[index]
+    _compile()
+
+
+def clear():
+    global _not_included
+    del _rules[:]
+    _not_included = 0
+    _compile()
+
+
+def rules():
+    """
+    :rtype: list[Rule]
+    """
+    return list(_rules)
+
+
+def suppressed():
+    """
+    :return: Total lines filtered out so far.
+    :rtype: int
+    """
+    return _not_included + sum(rule.suppressed for rule in _rules)
+
+
+def load_config(config):
+    """
+    Replaces the current rules with ones from `console.json`'s `filters` list, where each entry is like
+    `{"exclude": "pattern"}`, `{"highlight": "pattern", "color": "yellow"}` or `{"limit": "pattern", "per_second": 2}`.
+    Without a `filters` list, `DEFAULT_RULES` are used.
+
+    :type config: list[dict] | None
+    """
+    clear()
+    if config is None:
+        for kind, pattern, argument in DEFAULT_RULES:
+            add_rule(kind, pattern, argument)
+        return
+    for entry in config:
+        for kind in KINDS:
+            if kind in entry:
+                add_rule(kind, entry[kind], entry.get('color') if kind == HIGHLIGHT else entry.get('per_second'))
+                break
+        else:
+            raise ValueError("Filter {} has none of {}".format(entry, ', '.join(KINDS)))
+
+
+def filter_lines(texts):
+    """
+    :type texts: list[str]
+    :return: The lines which aren't filtered out, each with its highlight color, or None if no highlight rule matched.
+    :rtype: list[(str, str | None)]
+    """
+    global _not_included
+    if not _rules:
+        return [(text, None) for text in texts]
+    kept = []
+    for text in texts:
+        included = not _has_includes
+        color = None
+        limited_by = None
+        excluded_by = None
+        for rule in _matching_rules(text):
+            kind = rule.kind
+            if kind == EXCLUDE:
+                excluded_by = rule
+                break
+            elif kind == INCLUDE:
+                included = True
+            elif kind == HIGHLIGHT:
+                if color is None:
+                    color = rule.color
+            elif limited_by is None:
+                limited_by = rule
+        if excluded_by is not None:
+            excluded_by.suppressed += 1
+        elif not included:
+            _not_included += 1
+        elif limited_by is not None and not limited_by.allow():
+            limited_by.suppressed += 1
+        else:
+            kept.append((text, color))
+            continue
+        metrics.count('filtered_lines')
+    return kept
+
+
+def highlight_color(text):
+    """
+    :return: The color of the first highlight rule matching the text, without counting or rate limiting anything.
+    :rtype: str | None
+    """
+    for rule in _matching_rules(text):
+        if rule.kind == HIGHLIGHT:
+            return rule.color
+    return None
+
+
+def command(arguments):
+    """
+    Handles the `:filter` meta-command.
+
+    :type arguments: str
+    """
+    words = arguments.split(None, 1)
+    action = words[0] if words else 'list'
+    rest = words[1] if len(words) > 1 else ''
+    try:
+        if action == 'list':
+            for index, rule in enumerate(_rules):
+                interface.output_text('{}: {} ({} filtered)'.format(index, rule.describe(), rule.suppressed), False)
+            if _has_includes:
+                interface.output_text('{} lines matched no include rule'.format(_not_included), False)
+            if not _rules:
+                interface.output_text('No filters.', False)
+        elif action in (INCLUDE, EXCLUDE) and rest:
+            add_rule(action, rest)
+        elif action in (HIGHLIGHT, LIMIT) and len(rest.split(None, 1)) == 2:
+            argument, pattern = rest.split(None, 1)
+            add_rule(action, pattern, argument)
+        elif action == 'remove' and rest:
+            remove_rule(int(rest))
+        elif action == 'clear':
+            clear()
+        else:
+            interface.output_text(
+                "Usage: :filter [list | include PATTERN | exclude PATTERN | highlight COLOR PATTERN | "
+                "limit PER_SECOND PATTERN | remove INDEX | clear]", False)
+    except (ValueError, IndexError) as e:
+        interface.output_text("Filter not changed: {}".format(e), False)
+
+
+load_config(None)
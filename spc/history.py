@@ -0,0 +1,64 @@
+"""
+Command history kept between sessions.
+
+Each command is appended to the history file as it's entered. The file is only rewritten when loading it, once it's
+grown to twice the history size, so starting up never reads more than that.
+"""
+import readline
+import tempfile
+
+import os
+
+DEFAULT_HISTORY_FILE = '.console_history'
+DEFAULT_HISTORY_SIZE = 1000
+
+_file = None
+
+
+def load(path=None, size=None):
+    """
+    Adds the most recent commands in the history file to readline's history, and opens the file to append new ones.
+
+    :param path: History file, defaults to DEFAULT_HISTORY_FILE.
+    :param size: Commands to keep, defaults to DEFAULT_HISTORY_SIZE.
+    """
+    global _file
+    path = path or DEFAULT_HISTORY_FILE
+    size = size or DEFAULT_HISTORY_SIZE
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        lines = []
+    kept = []
+    for line in lines[-size:]:
+        if line and (not kept or kept[-1] != line):
+            kept.append(line)
+    for line in kept:
+        readline.add_history(line)
+    if len(lines) >= size * 2:
+        # Write the compacted history next to the old one and swap it in, so nothing's lost if this is interrupted.
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(os.path.abspath(path)),
+                                         delete=False) as f:
+            f.write(''.join(line + '\n' for line in kept))
+        os.replace(f.name, path)
+    try:
+        _file = open(path, 'a', encoding='utf-8')
+    except EnvironmentError:
+        _file = None
+
+
+def append(line):
+    """
+    :type line: str
+    """
+    if _file is not None:
+        _file.write(line + '\n')
+        _file.flush()
+
+
+def close():
+    global _file
+    if _file is not None:
+        _file.close()
+        _file = None
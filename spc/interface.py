@@ -1,28 +1,143 @@
 import asyncio
+import collections
+import ctypes
 import readline
+import sys
+import time
 from asyncio.tasks import FIRST_COMPLETED
 from time import strftime
 
 import colorama
 import signal
 
+from spc import history, metrics
+
+DEFAULT_OUTPUT_BACKLOG = 2000
+
 _input_loop_running = None
 _exit_required = None
+_output_loop = None
+_output_interval = 0
+_output_queue = collections.deque()
+_output_dropped = 0
+_output_flush_handle = None
+_output_file = None
+_meta_commands = collections.OrderedDict()
+_readline_library = None
+_libc = None
+# Non-printing characters in the prompt need to be marked for readline to work out its width
+PROMPT = '\001{}\002> '.format(colorama.Fore.RESET)
+_LINE_HANDLER = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+
+
+def initialize_output(loop, flush_interval=0, backlog=None, file=None):
+    """
+    Switches output_text from writing immediately to writing in batches, once per event loop iteration or once every
+    `flush_interval` seconds.
 
+    :type loop: asyncio.events.AbstractEventLoop
+    :param flush_interval: Seconds to wait between batches, or 0 to write on the next event loop iteration.
+    :param backlog: Maximum lines kept waiting to be written. Once reached, the oldest waiting lines are dropped and
+                    a summary line saying how many were dropped is written in their place.
+    :param file: Where to write output, defaults to stdout. Output written anywhere else is plain text, without colors
+                 or the prompt.
+    """
+    global _output_loop, _output_interval, _output_queue, _output_file
+    _output_file = file
+    _output_loop = loop
+    _output_interval = flush_interval or 0
+    _output_queue = collections.deque(_output_queue, maxlen=backlog or DEFAULT_OUTPUT_BACKLOG)
 
 
 def output_text(text, date=True, color=colorama.Fore.RESET):
-    print('\r  {}'.format(' ' * len(readline.get_line_buffer())), end='\r', flush=True)
-    if date:
-        print(color + strftime('[%m-%d %H:%M]'), text.strip())
-    else:
-        print(color + text)
+    global _output_dropped, _output_flush_handle
+    if _output_queue.maxlen is not None and len(_output_queue) >= _output_queue.maxlen:
+        _output_dropped += 1
+    _output_queue.append((text, date, color))
+    if _output_loop is None:
+        flush_output()
+    elif _output_flush_handle is None:
+        if _output_interval:
+            _output_flush_handle = _output_loop.call_later(_output_interval, flush_output)
+        else:
+            _output_flush_handle = _output_loop.call_soon(flush_output)
+
+
+def flush_output():
+    """
+    Writes all waiting output in one go, clearing and redrawing the prompt once for the whole batch.
+    """
+    global _output_dropped, _output_flush_handle
+    if _output_flush_handle is not None:
+        _output_flush_handle.cancel()
+        _output_flush_handle = None
+    if not _output_queue:
+        return
+
+    start = time.perf_counter()
+    metrics.count('output_lines', len(_output_queue))
+    # Output to a file instead of the terminal is for logs and scripts, so it's plain text with no prompt to redraw.
+    plain = _output_file is not None
+    line_buffer = '' if plain else readline.get_line_buffer()
+    date_prefix = strftime('[%m-%d %H:%M] ')
+    parts = [] if plain else ['\r  {}\r'.format(' ' * len(line_buffer))]
+    last_color = None
+    if _output_dropped:
+        parts.append('{}[{} lines dropped, output backlog full]\n'.format(
+            '' if plain else colorama.Fore.YELLOW, _output_dropped))
+        last_color = colorama.Fore.YELLOW
+        _output_dropped = 0
+    while _output_queue:
+        text, date, color = _output_queue.popleft()
+        if color != last_color and not plain:
+            parts.append(color)
+            last_color = color
+        if date:
+            parts.append(date_prefix)
+            parts.append(text.strip())
+        else:
+            parts.append(text)
+        parts.append('\n')
+    if _input_loop_running is None or not _input_loop_running.is_set():
+        parts.append(line_buffer)
+
+    file = _output_file or sys.stdout
+    file.write(''.join(parts))
+    file.flush()
     if _input_loop_running is not None and _input_loop_running.is_set():
-        print(colorama.Fore.RESET + '> {}'.format(readline.get_line_buffer()), end='', flush=True)
+        # Draws the prompt and whatever's been typed so far on the new line, with the cursor where it was
+        _readline_library.rl_forced_update_display()
+    metrics.observe('output_flush', time.perf_counter() - start)
+
+
+metrics.gauge('output_queue', lambda: len(_output_queue))
+
+
+def register_meta_command(name, handler, description):
+    """
+    Adds a command run locally when typed as `:name [arguments]`, instead of being sent to the server.
+
+    :type name: str
+    :param handler: Called with the rest of the line after the name, stripped.
+    :type handler: (str) -> None
+    :type description: str
+    """
+    _meta_commands[name] = (handler, description)
+
+
+def run_meta_command(text):
+    """
+    :param text: The full line, including the leading ':'.
+    :type text: str
+    """
+    name, _, arguments = text[1:].partition(' ')
+    if name in _meta_commands:
+        _meta_commands[name][0](arguments.strip())
     else:
-        print('{}'.format(readline.get_line_buffer()), end='', flush=True)
-    readline.insert_text('')
-    readline.redisplay()
+        if name and name != 'help':
+            output_text("Unknown command :{}".format(name), False)
+        for name, (_, description) in _meta_commands.items():
+            output_text(":{} - {}".format(name, description), False)
 
 
 def _completion(completer):
@@ -35,12 +150,19 @@ def _completion(completer):
 
 
 def initialize_readline(completer):
+    global _readline_library, _libc
     colorama.init()
     readline.parse_and_bind("tab: menu-complete")
     readline.parse_and_bind("\C-space: menu-complete")
 
     readline.set_completer(_completion(completer))
 
+    # The readline module doesn't expose readline's callback interface, but the library it's linked against does.
+    _readline_library = ctypes.CDLL(readline.__file__)
+    _readline_library.rl_callback_handler_install.argtypes = [ctypes.c_char_p, _LINE_HANDLER]
+    _libc = ctypes.CDLL(None)
+    _libc.free.argtypes = [ctypes.c_void_p]
+
 
 def initialize_signal_handlers(loop):
     """
@@ -58,34 +180,75 @@ def initialize_signal_handlers(loop):
     loop.add_signal_handler(signal.SIGTERM, handler)
 
 
+def request_exit():
+    """
+    Ends the input loop (or `wait_for_exit`) as if SIGINT had been received.
+    """
+    _exit_required.set()
+
+
+@asyncio.coroutine
+def wait_for_exit():
+    """
+    Waits for SIGINT or SIGTERM, for when there's no input loop to exit from.
+    """
+    yield from _exit_required.wait()
+
+
+def _handle_line(loop, connection, line):
+    """
+    :type loop: asyncio.events.AbstractEventLoop
+    :type connection: spc.communication.ActiveConnection | spc.multiplex.ConnectionGroup
+    :type line: str
+    """
+    line = line.strip()
+    if not line:
+        return
+    readline.add_history(line)
+    history.append(line)
+    if line.startswith(':'):
+        run_meta_command(line)
+    else:
+        asyncio.ensure_future(connection.send_command(line), loop=loop)
+
+
 @asyncio.coroutine
 def input_loop(loop, connection):
     """
+    Reads commands using readline's callback interface, one character at a time as stdin becomes readable, so no
+    thread ever blocks waiting for input. Returns on EOF or once exit is requested.
+
+    Requires `initialize_readline` to have been called.
+
     :type loop: asyncio.events.AbstractEventLoop
-    :type connection: spc.communication.ActiveConnection
+    :type connection: spc.communication.ActiveConnection | spc.multiplex.ConnectionGroup
     """
     global _input_loop_running
     if _input_loop_running is None:
         _input_loop_running = asyncio.Event(loop=loop)
+    end_of_input = asyncio.Future(loop=loop)
+
+    def line_received(pointer):
+        if pointer is None:
+            if not end_of_input.done():
+                end_of_input.set_result(None)
+            return
+        line = ctypes.string_at(pointer).decode('utf-8', 'replace')
+        _libc.free(pointer)
+        _handle_line(loop, connection, line)
+
+    # Kept referenced until the handler is removed, since readline only holds a pointer to it
+    handler = _LINE_HANDLER(line_received)
+    stdin = sys.stdin.fileno()
+    _readline_library.rl_callback_handler_install(PROMPT.encode(), handler)
+    loop.add_reader(stdin, _readline_library.rl_callback_read_char)
     _input_loop_running.set()
+    exit_required = asyncio.ensure_future(_exit_required.wait(), loop=loop)
     try:
-        while True:
-            print(colorama.Fore.RESET, end='')
-            done, pending = yield from asyncio.wait([
-                loop.run_in_executor(None, input, '> '),
-                _exit_required.wait()
-            ], loop=loop, return_when=FIRST_COMPLETED)
-            for x in pending:
-                x.cancel()
-            done = [x.result() for x in done]
-            if True in done:
-                # only _exit_required.wait() returns something that equals True.
-                # input will only ever return strings.
-                return
-            else:
-                result = done[0]
-            asyncio.ensure_future(connection.send_command(result.strip()), loop=loop)
-    except (EOFError, KeyboardInterrupt):
-        return
+        yield from asyncio.wait([end_of_input, exit_required], loop=loop, return_when=FIRST_COMPLETED)
     finally:
+        exit_required.cancel()
         _input_loop_running.clear()
+        loop.remove_reader(stdin)
+        _readline_library.rl_callback_handler_remove()
+        print()
@@ -0,0 +1,129 @@
+"""
+Always-on counters, latency histograms and gauges for the console's hot paths.
+
+Recording is a dict lookup and an increment, so it's cheap enough to leave in place everywhere. Histograms use fixed
+logarithmic buckets (4 per doubling, from 1us), so percentiles are accurate to within about 20%.
+"""
+import collections
+import json
+import math
+import time
+
+_BUCKETS_PER_DOUBLING = 4
+_SMALLEST = 1e-6
+
+_started = time.time()
+_counters = collections.Counter()
+_histograms = {}
+_gauges = collections.OrderedDict()
+_last_report = None
+
+
+class Histogram:
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        if value > _SMALLEST:
+            self.buckets[int(math.log2(value / _SMALLEST) * _BUCKETS_PER_DOUBLING)] += 1
+        else:
+            self.buckets[0] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """
+        :param fraction: Between 0 and 1.
+        :return: Upper bound of the bucket the percentile falls in.
+        """
+        if not self.count:
+            return 0.0
+        needed = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= needed:
+                return min(self.max, _SMALLEST * 2 ** ((bucket + 1) / _BUCKETS_PER_DOUBLING))
+        return self.max
+
+
+def count(name, amount=1):
+    _counters[name] += amount
+
+
+def observe(name, seconds):
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms[name] = Histogram()
+    histogram.observe(seconds)
+
+
+def gauge(name, function):
+    """
+    Registers a value which is only calculated when reporting.
+
+    :type name: str
+    :param function: Called with no arguments, returning the current value (or None to leave it out).
+    """
+    _gauges[name] = function
+
+
+def snapshot():
+    """
+    :rtype: dict
+    """
+    gauges = {}
+    for name, function in _gauges.items():
+        value = function()
+        if value is not None:
+            gauges[name] = value
+    return {
+        'uptime': time.time() - _started,
+        'counters': dict(_counters),
+        'histograms': {
+            name: {
+                'count': histogram.count,
+                'mean': histogram.total / histogram.count if histogram.count else 0.0,
+                'p50': histogram.percentile(0.5),
+                'p99': histogram.percentile(0.99),
+                'max': histogram.max,
+            } for name, histogram in _histograms.items()
+        },
+        'gauges': gauges,
+    }
+
+
+def report():
+    """
+    :return: Human readable lines describing everything recorded, with rates since the last report.
+    :rtype: list[str]
+    """
+    global _last_report
+    now = time.time()
+    current = snapshot()
+    lines = ['uptime {:.0f}s'.format(current['uptime'])]
+    for name, value in sorted(current['counters'].items()):
+        line = '{}: {} ({:.1f}/s'.format(name, value, value / max(current['uptime'], 1e-9))
+        if _last_report is not None:
+            last_time, last_counters = _last_report
+            line += ', {:.1f}/s since last'.format((value - last_counters.get(name, 0)) / max(now - last_time, 1e-9))
+        lines.append(line + ')')
+    for name, stats in sorted(current['histograms'].items()):
+        lines.append('{}: n={} p50={:.2f}ms p99={:.2f}ms max={:.2f}ms'.format(
+            name, stats['count'], stats['p50'] * 1000, stats['p99'] * 1000, stats['max'] * 1000))
+    for name, value in current['gauges'].items():
+        lines.append('{}: {}'.format(name, value))
+    _last_report = (now, current['counters'])
+    return lines
+
+
+def dump(path):
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=4)
@@ -0,0 +1,116 @@
+import asyncio
+
+from spc import api, communication, interface, ratelimit
+
+ALL_TARGETS = 'all'
+
+
+def connection_from_config(loop, config, defaults=None, api_session=None):
+    """
+    :param config: One connection's settings, as in `console.json`.
+    :param defaults: Settings used for anything missing from `config`.
+    :rtype: spc.communication.ActiveConnection
+    """
+    settings = dict(defaults or {})
+    settings.update(config)
+    return communication.ActiveConnection(
+        loop, settings['user'], settings['password'],
+        ws_url=settings.get('ws_url'),
+        api_url=settings.get('api_url'),
+        http_concurrency=settings.get('http_concurrency'),
+        http_timeout=settings.get('http_timeout'),
+        batch_window=settings.get('batch_window'),
+        batch_max_commands=settings.get('batch_max_commands'),
+        rate_limit_per_hour=settings.get('rate_limit_per_hour'),
+        rate_limit_burst=settings.get('rate_limit_burst'),
+        shard=settings.get('shard'),
+        name=settings.get('name'),
+        api_session=api_session,
+        cached_expressions=settings.get('cached_expressions'),
+        result_cache_ticks=settings.get('result_cache_ticks'),
+        result_cache_seconds=settings.get('result_cache_seconds'),
+    )
+
+
+class ConnectionGroup:
+    """
+    Several connections, to any mix of accounts and shards, sharing one event loop and one HTTP connection pool.
+
+    Commands go to the default connection unless they start with `@<target> `, where target is a connection's name,
+    its username, its shard, or `all`. Commands for more than one connection are sent to all of them at once.
+
+    :type _loop: asyncio.events.AbstractEventLoop
+    :type connections: list[spc.communication.ActiveConnection]
+    :type default: spc.communication.ActiveConnection
+    """
+
+    def __init__(self, loop, connections, api_session=None):
+        """
+        :param api_session: Session shared by the connections, closed along with the group.
+        :type api_session: spc.api.SharedSession
+        """
+        self._loop = loop
+        self._api_session = api_session
+        self.connections = connections
+        self.default = connections[0]
+        if len(connections) > 1:
+            for connection in connections:
+                connection.tag = connection.name
+
+    @classmethod
+    def from_config(cls, loop, config):
+        """
+        Reads `console.json` settings: either a single connection's settings, or a `connections` list of them, with
+        top-level settings used as defaults.
+
+        :rtype: ConnectionGroup
+        """
+        connection_configs = config.get('connections') or [{}]
+        defaults = {key: value for key, value in config.items() if key != 'connections'}
+        if len(connection_configs) > 1:
+            api_session = api.SharedSession(loop, config.get('http_concurrency'))
+        else:
+            api_session = None
+        return cls(loop, [connection_from_config(loop, connection_config, defaults, api_session)
+                          for connection_config in connection_configs], api_session)
+
+    def targets(self, target):
+        """
+        :type target: str
+        :rtype: list[spc.communication.ActiveConnection]
+        """
+        if target == ALL_TARGETS:
+            return self.connections
+        for matches in (lambda c: c.name == target, lambda c: c.username == target, lambda c: c.shard == target):
+            found = [connection for connection in self.connections if matches(connection)]
+            if found:
+                return found
+        return []
+
+    @asyncio.coroutine
+    def connect(self):
+        yield from asyncio.gather(*(connection.connect() for connection in self.connections), loop=self._loop)
+
+    @asyncio.coroutine
+    def send_command(self, text, priority=ratelimit.PRIORITY_INTERACTIVE, cached=False):
+        """
+        :param cached: See `spc.communication.ActiveConnection.send_command`.
+        :return: Whether the command was sent to every connection it was for.
+        :rtype: bool
+        """
+        connections = [self.default]
+        if text.startswith('@') and len(self.connections) > 1:
+            target, _, text = text[1:].partition(' ')
+            connections = self.targets(target)
+            if not connections:
+                interface.output_text("No connection matches @{}.".format(target), False)
+                return False
+        sent = yield from asyncio.gather(*(connection.send_command(text, priority, cached)
+                                           for connection in connections), loop=self._loop)
+        return all(sent)
+
+    @asyncio.coroutine
+    def close(self):
+        yield from asyncio.gather(*(connection.close() for connection in self.connections), loop=self._loop)
+        if self._api_session is not None:
+            yield from self._api_session.close()
@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import random
+import time
+
+import itertools
+
+PRIORITY_INTERACTIVE = 0
+# Members fetched for a completion the user is waiting on
+PRIORITY_COMPLETION = 5
+PRIORITY_BACKGROUND = 10
+
+# The screeps.com quota for POST /api/user/console
+DEFAULT_RATE_PER_HOUR = 360
+DEFAULT_BURST = 60
+
+TOO_MANY_REQUESTS = 429
+
+
+class TokenBucket:
+    """
+    :type _loop: asyncio.events.AbstractEventLoop
+    """
+
+    def __init__(self, loop, rate, capacity):
+        """
+        :param rate: Tokens added per second.
+        :param capacity: Maximum tokens held at once.
+        """
+        self._loop = loop
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = loop.time()
+        self._paused_until = 0
+
+    def _refill(self):
+        now = self._loop.time()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        return now
+
+    def delay(self):
+        """
+        :return: Seconds until a token is available, 0 if one is available now.
+        """
+        now = self._refill()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def take(self):
+        self._refill()
+        self._tokens -= 1
+
+    def pause(self, seconds):
+        """
+        Hands out no tokens for the given number of seconds, and starts again from empty afterwards.
+        """
+        self._refill()
+        self._tokens = 0
+        self._paused_until = max(self._paused_until, self._loop.time() + seconds)
+
+    def update_from_headers(self, headers):
+        """
+        Trusts the server's idea of how many requests are left, if it sent one.
+
+        :type headers: collections.Mapping[str, str]
+        """
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+        except (KeyError, ValueError):
+            return
+        self._refill()
+        self._tokens = min(self._tokens, remaining)
+        if remaining <= 0:
+            reset_in = _reset_in(headers)
+            if reset_in is not None:
+                self.pause(reset_in)
+
+
+def _reset_in(headers):
+    try:
+        return max(0, int(headers['X-RateLimit-Reset']) - time.time())
+    except (KeyError, ValueError):
+        return None
+
+
+def _retry_after(headers):
+    try:
+        return max(0, float(headers['Retry-After']))
+    except (KeyError, ValueError):
+        return _reset_in(headers)
+
+
+class _Job:
+    __slots__ = ('send', 'future', 'attempts')
+
+    def __init__(self, send, future):
+        self.send = send
+        self.future = future
+        self.attempts = 0
+
+
+class CommandScheduler:
+    """
+    Sends requests one token at a time from a token bucket, most urgent priority first. Rate limited (HTTP 429)
+    responses are retried after the time the server asks for, or with jittered exponential backoff if it doesn't say.
+
+    :type _loop: asyncio.events.AbstractEventLoop
+    :type _queue: list[(int, int, _Job)]
+    """
+
+    def __init__(self, loop, rate_per_hour=None, burst=None, max_retries=5, backoff_base=1, backoff_max=120):
+        self._loop = loop
+        self._bucket = TokenBucket(loop, (rate_per_hour or DEFAULT_RATE_PER_HOUR) / 3600, burst or DEFAULT_BURST)
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._queue = []
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event(loop=loop)
+        self._worker = None
+
+    def queued(self):
+        """
+        :return: Number of requests waiting to be sent
+        :rtype: int
+        """
+        return len(self._queue)
+
+    @asyncio.coroutine
+    def submit(self, send, priority=PRIORITY_INTERACTIVE):
+        """
+        :param send: Coroutine function making the request, returning an `ApiResponse`.
+        :param priority: Lower numbers go first.
+        :rtype: spc.api.ApiResponse
+        """
+        future = asyncio.Future(loop=self._loop)
+        heapq.heappush(self._queue, (priority, next(self._sequence), _Job(send, future)))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run(), loop=self._loop)
+        self._wakeup.set()
+        return (yield from future)
+
+    @asyncio.coroutine
+    def _run(self):
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                yield from self._wakeup.wait()
+            delay = self._bucket.delay()
+            if delay > 0:
+                yield from asyncio.sleep(delay, loop=self._loop)
+                continue
+            self._bucket.take()
+            priority, sequence, job = heapq.heappop(self._queue)
+            if not job.future.cancelled():
+                asyncio.ensure_future(self._attempt(priority, sequence, job), loop=self._loop)
+
+    @asyncio.coroutine
+    def _attempt(self, priority, sequence, job):
+        try:
+            response = yield from job.send()
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        self._bucket.update_from_headers(response.headers)
+        if response.status_code == TOO_MANY_REQUESTS and job.attempts < self._max_retries:
+            job.attempts += 1
+            wait = _retry_after(response.headers)
+            if wait is None:
+                wait = min(self._backoff_max, self._backoff_base * 2 ** job.attempts) * random.uniform(0.5, 1)
+            self._bucket.pause(wait)
+            # Keep the original place in the queue
+            heapq.heappush(self._queue, (priority, sequence, job))
+            self._wakeup.set()
+        elif not job.future.done():
+            job.future.set_result(response)
+
+    @asyncio.coroutine
+    def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for _, _, job in self._queue:
+            job.future.cancel()
+        self._queue = []
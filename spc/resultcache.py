@@ -0,0 +1,129 @@
+"""
+Opt-in cache of results for expressions which are safe to repeat, like `Game.cpu.bucket` or `Object.keys(Game.rooms)`.
+
+A cached result is reused until the server's clock, from the `time` frames it sends over the websocket, has moved on by
+`ttl_ticks`, or until `max_age` seconds have passed, whichever comes first. An expression sent while the same one is
+still waiting for its result isn't sent again, and shares that result instead.
+"""
+import collections
+import json
+import re
+import time
+
+from spc import execute, tagged
+
+DEFAULT_TTL_TICKS = 1
+# Seconds, for servers which don't send `time` frames every tick
+DEFAULT_MAX_AGE = 5
+MAX_ENTRIES = 100
+# Seconds before an expression still waiting for its result is assumed lost, and sent again
+PENDING_TIMEOUT = 30
+
+
+class ResultCache:
+    """
+    :type _entries: collections.OrderedDict[str, (str, int | None, float)]
+    :type _pending: dict[str, (int, int, float)]
+    :type _expressions: dict[int, str]
+    """
+
+    def __init__(self, patterns=None, ttl_ticks=None, max_age=None):
+        """
+        :param patterns: Regexes for expressions which are always cached, without needing to ask.
+        :type patterns: list[str] | None
+        :param ttl_ticks: Ticks a result is reused for.
+        :param max_age: Seconds a result is reused for.
+        """
+        self._pattern = re.compile('(?:{})$'.format('|'.join(patterns))) if patterns else None
+        self._ttl_ticks = ttl_ticks or DEFAULT_TTL_TICKS
+        self._max_age = max_age or DEFAULT_MAX_AGE
+        self._entries = collections.OrderedDict()
+        self._pending = {}
+        self._expressions = {}
+        self._next_id = 0
+        self.keyword = tagged.new_keyword('__rc_')
+        self.tick = None
+
+    def is_cacheable(self, expression):
+        return self._pattern is not None and self._pattern.match(expression) is not None
+
+    def set_time(self, value):
+        """
+        :param value: The value of a `time` frame.
+        :type value: str
+        """
+        try:
+            self.tick = int(value)
+        except ValueError:
+            pass
+
+    def get(self, expression):
+        """
+        :return: The cached result, or None if there isn't one or it's expired.
+        :rtype: str | None
+        """
+        entry = self._entries.get(expression)
+        if entry is None:
+            return None
+        result, tick, stored = entry
+        if (time.time() - stored >= self._max_age
+                or self.tick is not None and tick is not None and self.tick - tick >= self._ttl_ticks):
+            del self._entries[expression]
+            return None
+        return result
+
+    def request(self, expression):
+        """
+        Notes that the expression is wanted.
+
+        :return: The command to send for it, or None if the same expression is already waiting for its result.
+        :rtype: str | None
+        """
+        pending = self._pending.get(expression)
+        if pending is not None and time.time() - pending[2] < PENDING_TIMEOUT:
+            request_id, waiters, sent = pending
+            self._pending[expression] = (request_id, waiters + 1, sent)
+            return None
+        if pending is not None:
+            del self._expressions[pending[0]]
+        self._next_id += 1
+        self._pending[expression] = (self._next_id, 1, time.time())
+        self._expressions[self._next_id] = expression
+        return execute.EXEC_COMMAND.format(keyword=self.keyword, index=self._next_id,
+                                           expression=json.dumps(expression))
+
+    def failed(self, expression):
+        """
+        Forgets that the expression is waiting for its result, after sending it failed, so it's sent again next time.
+        """
+        pending = self._pending.pop(expression, None)
+        if pending is not None:
+            self._expressions.pop(pending[0], None)
+
+    def is_active(self):
+        return bool(self._pending)
+
+    def is_result(self, text):
+        return bool(self._pending) and text.startswith(self.keyword)
+
+    def received(self, text):
+        """
+        :param text: A tagged result, including the keyword.
+        :return: (succeeded, result, number of requests waiting for it), or None if nothing's waiting for it.
+        :rtype: (bool, str, int) | None
+        """
+        split = tagged.split_index(text[len(self.keyword):])
+        if split is None:
+            return None
+        request_id, separator, result = split
+        expression = self._expressions.pop(request_id, None)
+        if expression is None:
+            return None
+        _, waiters, _ = self._pending.pop(expression)
+        succeeded = separator == ':'
+        if succeeded:
+            self._entries[expression] = (result, self.tick, time.time())
+            self._entries.move_to_end(expression)
+            while len(self._entries) > MAX_ENTRIES:
+                self._entries.popitem(last=False)
+        return succeeded, result, waiters
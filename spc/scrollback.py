@@ -0,0 +1,176 @@
+"""
+Bounded in-memory history of console output, searchable with `:search`.
+
+Lines are kept in a fixed size ring as a timestamp, a channel and the raw UTF-8 text, and only formatted and colored
+when a search shows them. Once either the line or byte limit is reached the oldest lines are dropped, so memory use
+stays flat however long the console runs.
+"""
+import array
+import re
+import time
+
+import colorama
+
+from spc import filters, interface
+
+CHANNEL_LOG = 0
+CHANNEL_RESULTS = 1
+CHANNEL_ERROR = 2
+
+DEFAULT_MAX_LINES = 10000
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+# Most matching lines shown by one search, the newest ones are shown if there are more
+DEFAULT_SEARCH_LIMIT = 200
+
+_duration_regex = re.compile(r'^(\d+)([smhd])$')
+_duration_units = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+class Scrollback:
+    """
+    :type _times: array.array
+    :type _channels: bytearray
+    :type _texts: list[bytes | None]
+    """
+
+    def __init__(self, max_lines=DEFAULT_MAX_LINES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self._times = array.array('q', [0]) * max_lines
+        self._channels = bytearray(max_lines)
+        self._texts = [None] * max_lines
+        self._start = 0
+        self._count = 0
+        self.size = 0
+
+    def __len__(self):
+        return self._count
+
+    def _drop_oldest(self):
+        self.size -= len(self._texts[self._start])
+        self._texts[self._start] = None
+        self._start = (self._start + 1) % self.max_lines
+        self._count -= 1
+
+    def append(self, channel, text, timestamp=None):
+        """
+        :param channel: One of the `CHANNEL_*` constants.
+        :type text: str
+        :param timestamp: Seconds since the epoch, defaults to now.
+        """
+        encoded = text.encode('utf-8')
+        if len(encoded) > self.max_bytes:
+            return
+        while self._count and (self._count >= self.max_lines or self.size + len(encoded) > self.max_bytes):
+            self._drop_oldest()
+        position = (self._start + self._count) % self.max_lines
+        self._times[position] = int(timestamp if timestamp is not None else time.time())
+        self._channels[position] = channel
+        self._texts[position] = encoded
+        self._count += 1
+        self.size += len(encoded)
+
+    def search(self, pattern=None, since=None, until=None, limit=None):
+        """
+        :param pattern: Regex to search for, case insensitive.
+        :type pattern: str | None
+        :param since: Earliest timestamp to include.
+        :param until: Latest timestamp to include.
+        :param limit: Only return the newest this many matches.
+        :return: (timestamp, channel, text) for each matching line, oldest first.
+        :rtype: list[(int, int, str)]
+        """
+        # Matched against the decoded text, since case insensitive matching and classes like \w only cover ASCII
+        # when matching bytes.
+        regex = re.compile(pattern, re.IGNORECASE) if pattern else None
+        matches = []
+        for offset in range(self._count - 1, -1, -1):
+            position = (self._start + offset) % self.max_lines
+            timestamp = self._times[position]
+            if until is not None and timestamp > until:
+                continue
+            if since is not None and timestamp < since:
+                break
+            text = self._texts[position].decode('utf-8')
+            if regex is not None and not regex.search(text):
+                continue
+            matches.append((timestamp, self._channels[position], text))
+            if limit is not None and len(matches) >= limit:
+                break
+        matches.reverse()
+        return matches
+
+
+_scrollback = Scrollback()
+
+
+def configure(max_lines=None, max_bytes=None):
+    """
+    Replaces the scrollback with an empty one with the given limits.
+    """
+    global _scrollback
+    _scrollback = Scrollback(max_lines or DEFAULT_MAX_LINES, max_bytes or DEFAULT_MAX_BYTES)
+
+
+def record(channel, text):
+    _scrollback.append(channel, text)
+
+
+def search(pattern=None, since=None, until=None, limit=None):
+    """
+    See `Scrollback.search`.
+    """
+    return _scrollback.search(pattern, since, until, limit)
+
+
+def _parse_time(text, now):
+    """
+    :param text: A duration ago like `30s`, `10m`, `2h` or `1d`, or a time today like `14:30`.
+    :rtype: int
+    :raises ValueError: If it's neither.
+    """
+    match = _duration_regex.match(text)
+    if match:
+        return int(now - int(match.group(1)) * _duration_units[match.group(2)])
+    parsed = time.strptime(text, '%H:%M')
+    today = time.localtime(now)
+    return int(time.mktime(today[:3] + (parsed.tm_hour, parsed.tm_min, 0) + today[6:]))
+
+
+def _show(timestamp, channel, text):
+    date = time.strftime('[%m-%d %H:%M] ', time.localtime(timestamp))
+    if channel == CHANNEL_ERROR:
+        interface.output_text(date + text, False, colorama.Fore.RED)
+    elif channel == CHANNEL_LOG:
+        interface.output_text(date + text, False, filters.highlight_color(text) or colorama.Fore.RESET)
+    else:
+        interface.output_text(date + text, False)
+
+
+def command(arguments):
+    """
+    Handles the `:search [-since TIME] [-until TIME] [PATTERN]` meta-command.
+
+    :type arguments: str
+    """
+    now = time.time()
+    since = until = None
+    words = arguments.split(' ')
+    try:
+        while len(words) >= 2 and words[0] in ('-since', '-until'):
+            if words[0] == '-since':
+                since = _parse_time(words[1], now)
+            else:
+                until = _parse_time(words[1], now)
+            words = words[2:]
+        pattern = ' '.join(words).strip()
+        matches = search(pattern or None, since, until, DEFAULT_SEARCH_LIMIT)
+    except (ValueError, re.error) as e:
+        interface.output_text("Usage: :search [-since TIME] [-until TIME] [PATTERN], where TIME is like 10m, 2h or "
+                              "14:30 ({})".format(e), False)
+        return
+    for timestamp, channel, text in matches:
+        _show(timestamp, channel, text)
+    interface.output_text("{} matching lines{} ({} lines, {} bytes kept)".format(
+        len(matches), ', showing the newest' if len(matches) >= DEFAULT_SEARCH_LIMIT else '', len(_scrollback),
+        _scrollback.size), False)
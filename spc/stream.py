@@ -0,0 +1,157 @@
+"""
+Headless output: console messages written as JSON lines to a file or stdout, for monitoring.
+"""
+import asyncio
+import concurrent.futures
+import gzip
+import json
+import shutil
+import sys
+import time
+
+import os
+
+from spc import interface, metrics
+
+DEFAULT_FLUSH_INTERVAL = 0.5
+# Lines waiting to be written before a write is started without waiting for the flush interval
+DEFAULT_FLUSH_LINES = 5000
+
+
+class RotationError(Exception):
+    """
+    Rotating the file failed, after the batch being written was written successfully.
+    """
+
+
+class JsonlSink:
+    """
+    Buffers records in memory and writes them in batches from a single background thread, so the receive loop never
+    waits on the disk. When writing to a file, it's rotated once it reaches `rotate_bytes` bytes or has been open for
+    `rotate_seconds` seconds: the full file is renamed with a timestamp suffix, and gzip compressed if `compress` is
+    set.
+
+    :type _loop: asyncio.events.AbstractEventLoop
+    :type _path: str | None
+    :type _buffer: list[str]
+    """
+
+    def __init__(self, loop, path='-', rotate_bytes=None, rotate_seconds=None, compress=False,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, flush_lines=DEFAULT_FLUSH_LINES):
+        """
+        :param path: File to write to, or '-' for stdout.
+        """
+        self._loop = loop
+        self._path = None if path == '-' else path
+        self._rotate_bytes = rotate_bytes
+        self._rotate_seconds = rotate_seconds
+        self._compress = compress
+        self._flush_interval = flush_interval
+        self._flush_lines = flush_lines
+        self._buffer = []
+        self._flush_handle = None
+        self._pending_write = None
+        # One thread, so that batches are written in order
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+        self._file = None
+        self._file_size = 0
+        self._file_opened = 0
+        self.written = 0
+        # Lines lost to failed writes
+        self.failed = 0
+
+    def handle_messages(self, connection, texts, source, channel, shard):
+        """
+        Matches `ActiveConnection.message_handler`.
+
+        :type connection: spc.communication.ActiveConnection
+        """
+        timestamp = round(time.time(), 3)
+        for text in texts:
+            self._buffer.append(json.dumps({
+                'timestamp': timestamp,
+                'connection': connection.name,
+                'shard': shard or connection.shard,
+                'channel': channel,
+                'type': source,
+                'text': text,
+            }))
+        if len(self._buffer) >= self._flush_lines:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self._flush_interval, self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._buffer:
+            return
+        data = '\n'.join(self._buffer) + '\n'
+        lines = len(self._buffer)
+        self._buffer = []
+        self._pending_write = self._loop.run_in_executor(self._executor, self._write, data)
+        self._pending_write.add_done_callback(lambda future: self._write_done(future, lines))
+
+    def _write_done(self, future, lines):
+        if future.cancelled() or future.exception() is None:
+            return
+        metrics.count('stream_write_errors')
+        if isinstance(future.exception(), RotationError):
+            interface.output_text("Failed to rotate {}: {}".format(self._path, future.exception()), False)
+            return
+        self.failed += lines
+        metrics.count('stream_lines_lost', lines)
+        interface.output_text("Failed to write {} lines to {}: {}".format(
+            lines, self._path or 'stdout', future.exception()), False)
+
+    def _open(self):
+        self._file = open(self._path, 'ab')
+        self._file_size = self._file.tell()
+        self._file_opened = time.time()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        rotated = '{}.{}'.format(self._path, time.strftime('%Y%m%d-%H%M%S'))
+        suffix = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + '.gz'):
+            rotated = '{}.{}-{}'.format(self._path, time.strftime('%Y%m%d-%H%M%S'), suffix)
+            suffix += 1
+        os.replace(self._path, rotated)
+        if self._compress:
+            with open(rotated, 'rb') as source, gzip.open(rotated + '.gz', 'wb') as destination:
+                shutil.copyfileobj(source, destination)
+            os.remove(rotated)
+
+    def _write(self, data):
+        # Runs in the writer thread
+        if self._path is None:
+            sys.stdout.write(data)
+            sys.stdout.flush()
+            self.written += data.count('\n')
+            return
+        if self._file is None:
+            self._open()
+        encoded = data.encode('utf-8')
+        self._file.write(encoded)
+        self._file.flush()
+        self._file_size += len(encoded)
+        self.written += data.count('\n')
+        if ((self._rotate_bytes and self._file_size >= self._rotate_bytes)
+                or (self._rotate_seconds and time.time() - self._file_opened >= self._rotate_seconds)):
+            try:
+                self._rotate()
+            except EnvironmentError as e:
+                raise RotationError(e) from e
+
+    @asyncio.coroutine
+    def close(self):
+        self.flush()
+        if self._pending_write is not None:
+            # Any error is reported by _write_done.
+            yield from asyncio.wait([self._pending_write], loop=self._loop)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._executor.shutdown()
@@ -0,0 +1,34 @@
+"""
+Tagged results, for the console's own expressions: each reply starts with a random keyword, so it can be told apart
+from the user's output, followed by an index saying which request it answers.
+"""
+import random
+import string
+
+
+def new_keyword(prefix):
+    """
+    :param prefix: Short name for what the replies are for, like `__ex_`.
+    :return: The prefix followed by random characters and `:`, unlikely to turn up in any other output.
+    :rtype: str
+    """
+    return '{}{}:'.format(prefix, ''.join(random.choice(string.ascii_uppercase + string.ascii_lowercase + string.digits)
+                                          for _ in range(5)))
+
+
+def split_index(text):
+    """
+    Splits a tagged reply, with its keyword already removed, like `12:result` or `12!error`.
+
+    :type text: str
+    :return: (index, the character after it, the rest), or None if it doesn't start with an index.
+    :rtype: (int, str, str) | None
+    """
+    for position, char in enumerate(text):
+        if not char.isdigit():
+            break
+    else:
+        return None
+    if position == 0:
+        return None
+    return int(text[:position]), char, text[position + 1:]
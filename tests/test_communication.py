@@ -0,0 +1,22 @@
+import unittest
+
+from spc import communication
+
+
+class SplitBatchResultTest(unittest.TestCase):
+    keyword = '__b_abcde:'
+
+    def test_results_in_order(self):
+        text = '__b_abcde:0:first\n__b_abcde:1!Error: oops\n__b_abcde:2:third'
+        self.assertEqual(communication.split_batch_result(text, self.keyword),
+                         [(0, False, 'first'), (1, True, 'Error: oops'), (2, False, 'third')])
+
+    def test_multiline_results(self):
+        text = '__b_abcde:0:line one\nline two\n__b_abcde:1:'
+        self.assertEqual(communication.split_batch_result(text, self.keyword),
+                         [(0, False, 'line one\nline two'), (1, False, '')])
+
+    def test_keyword_inside_a_result(self):
+        text = '__b_abcde:0:says __b_abcde:1:not a marker'
+        self.assertEqual(communication.split_batch_result(text, self.keyword),
+                         [(0, False, 'says __b_abcde:1:not a marker')])
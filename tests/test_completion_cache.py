@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from spc import completion_cache
+
+
+class CompletionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        definitions = {
+            'global': ['Game', 'Memory', 'RawMemory'],
+            'Game': ['creeps', 'rooms', 'time'],
+            'Memory': [],
+            'Room': ['name', 'find', 'énergie', 'memory'],
+        }
+        completion_cache.save(self.path, definitions, 1234567890)
+        loaded = completion_cache.load(self.path)
+        try:
+            self.assertEqual(loaded.last_update, 1234567890)
+            self.assertEqual(sorted(loaded), sorted(definitions))
+            self.assertEqual(len(loaded), len(definitions))
+            for name, members in definitions.items():
+                self.assertIn(name, loaded)
+                self.assertEqual(loaded[name], members)
+            self.assertNotIn('Creep', loaded)
+            with self.assertRaises(KeyError):
+                loaded['Creep']
+        finally:
+            loaded.close()
+
+    def test_overlay(self):
+        completion_cache.save(self.path, {'Game': ['time']}, 0)
+        loaded = completion_cache.load(self.path)
+        try:
+            loaded['Game'] = ['time', 'cpu']
+            loaded['Creep'] = ['say']
+            self.assertEqual(loaded['Game'], ['time', 'cpu'])
+            self.assertEqual(sorted(loaded), ['Creep', 'Game'])
+        finally:
+            loaded.close()
+
+    def test_empty(self):
+        completion_cache.save(self.path, {}, 0)
+        loaded = completion_cache.load(self.path)
+        try:
+            self.assertFalse(loaded)
+            self.assertEqual(list(loaded), [])
+        finally:
+            loaded.close()
+
+    def test_missing_or_other_format(self):
+        self.assertIsNone(completion_cache.load(self.path))
+        with open(self.path, 'w') as file:
+            file.write('{"last_update": 0}')
+        self.assertIsNone(completion_cache.load(self.path))
+        open(self.path, 'w').close()
+        self.assertIsNone(completion_cache.load(self.path))
@@ -0,0 +1,89 @@
+import unittest
+
+from spc import filters
+
+
+class KeywordTest(unittest.TestCase):
+    def test_literals(self):
+        self.assertEqual(filters._keyword('error'), 'error')
+        self.assertEqual(filters._keyword('^CPU used: \\d+$'), 'cpu used: ')
+        self.assertEqual(filters._keyword('spawn\\.name'), 'spawn.name')
+
+    def test_optional_characters_are_left_out(self):
+        self.assertEqual(filters._keyword('colou?r'), 'colo')
+        self.assertEqual(filters._keyword('ab*cdef'), 'cdef')
+        self.assertEqual(filters._keyword('x{0,2}yz'), 'yz')
+
+    def test_groups_and_classes_are_left_out(self):
+        self.assertEqual(filters._keyword('(warn): [a-z]+ failed'), ' failed')
+        self.assertEqual(filters._keyword('(a)\\1bc'), 'bc')
+
+    def test_no_keyword(self):
+        self.assertEqual(filters._keyword('warn|error'), '')
+        self.assertEqual(filters._keyword('(warn|error): x'), '')
+        self.assertEqual(filters._keyword('\\d+'), '')
+
+    def test_escape_arguments_are_left_out(self):
+        self.assertEqual(filters._keyword('\\x41bc'), 'bc')
+        self.assertEqual(filters._keyword('\\u0041bc'), 'bc')
+        self.assertEqual(filters._keyword('\\N{LATIN SMALL LETTER A}bc'), 'bc')
+        self.assertEqual(filters._keyword('\\101bc'), 'bc')
+
+    def test_inline_flags(self):
+        self.assertEqual(filters._keyword('(?x) a b c'), '')
+        self.assertEqual(filters._keyword('(?-i:ab)cd'), '')
+
+    def test_backslash_in_class(self):
+        self.assertEqual(filters._keyword('[a\\]b]x'), '')
+
+
+class FilterTest(unittest.TestCase):
+    def tearDown(self):
+        filters.load_config(None)
+
+    def kept(self, lines):
+        return [text for text, _ in filters.filter_lines(lines)]
+
+    def test_include_and_exclude(self):
+        filters.load_config([{'include': 'creep'}, {'exclude': 'spawning'}])
+        self.assertEqual(self.kept(['Creep moved', 'creep spawning', 'tower fired']), ['Creep moved'])
+        self.assertEqual(filters.suppressed(), 2)
+
+    def test_backreference(self):
+        filters.load_config([{'exclude': 'x'}, {'include': '(a)\\1'}])
+        self.assertEqual(self.kept(['aa', 'ab', 'xaa']), ['aa'])
+
+    def test_same_named_group_in_two_rules(self):
+        filters.load_config([{'exclude': '(?P<n>a)b'}])
+        filters.add_rule(filters.EXCLUDE, '(?P<n>c)d')
+        self.assertEqual(self.kept(['ab', 'cd', 'ef']), ['ef'])
+
+    def test_invalid_pattern_leaves_rules_unchanged(self):
+        filters.load_config([{'exclude': 'noise'}])
+        with self.assertRaises(ValueError):
+            filters.add_rule(filters.EXCLUDE, '(unclosed')
+        self.assertEqual([rule.pattern for rule in filters.rules()], ['noise'])
+        filters.add_rule(filters.EXCLUDE, 'more noise')
+        self.assertEqual(len(filters.rules()), 2)
+
+    def test_overlapping_keywords(self):
+        filters.load_config([{'exclude': 'abc'}, {'exclude': 'cde'}, {'exclude': 'err'}, {'exclude': 'error'}])
+        self.assertEqual(self.kept(['xxcdexx', 'abcde', 'an error', 'errand', 'fine']), ['fine'])
+
+    def test_rule_without_keyword(self):
+        filters.load_config([{'exclude': 'warn|error'}])
+        self.assertEqual(self.kept(['a warning', 'an ERROR', 'fine']), ['fine'])
+
+    def test_case_insensitive(self):
+        filters.load_config([{'exclude': 'session'}, {'exclude': 'kelvin'}])
+        self.assertEqual(self.kept(['SESSION', 'ſeſſion', 'Kelvin', 'fine']), ['fine'])
+
+    def test_dotted_capital_i(self):
+        filters.load_config([{'exclude': 'item'}, {'exclude': 'bit'}])
+        self.assertEqual(self.kept(['İTEM', 'bİt', 'bıt', 'fine']), ['fine'])
+
+    def test_highlight(self):
+        filters.load_config([{'highlight': 'error', 'color': 'red'}, {'highlight': 'err', 'color': 'yellow'}])
+        self.assertEqual(filters.filter_lines(['an error', 'errand', 'fine']),
+                         [('an error', filters.colorama.Fore.RED), ('errand', filters.colorama.Fore.YELLOW),
+                          ('fine', None)])
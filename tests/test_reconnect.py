@@ -0,0 +1,33 @@
+import asyncio
+import unittest
+
+from benchmarks.stub_server import StubServer
+from spc import communication
+
+
+class ReconnectTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = StubServer(self.loop)
+        self.loop.run_until_complete(self.server.start())
+        self.connection = communication.ActiveConnection(self.loop, 'test', 'test', self.server.ws_url,
+                                                         self.server.api_url)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.connection.close())
+        self.loop.run_until_complete(self.server.stop())
+        self.loop.close()
+
+    @asyncio.coroutine
+    def wait_until_ready(self):
+        yield from self.server.wait_for_subscriber()
+        while self.connection.state != communication.STATE_READY:
+            yield from asyncio.sleep(0.01, loop=self.loop)
+
+    def test_reconnects_after_the_server_drops_the_socket(self):
+        self.loop.run_until_complete(self.connection.connect())
+        self.loop.run_until_complete(asyncio.wait_for(self.wait_until_ready(), 5, loop=self.loop))
+        self.loop.run_until_complete(self.server.drop_connections())
+        self.loop.run_until_complete(asyncio.wait_for(self.wait_until_ready(), 5, loop=self.loop))
+        self.assertEqual(self.connection.state, communication.STATE_READY)
+        self.assertEqual(len(self.connection.reconnect_times), 1)